@@ -0,0 +1,61 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" Benchmarks of vintel. Run them from the src directory, f.e.
+        python -m benchmarks.chatparsing
+    The data directory holds a generated corpus of chat lines in the format
+    of the logs: random intel made of the system names of the
+    Providencecatch map (full, abbreviated, lower case), ship names and
+    the usual words of intel channels, said by "Anon Pilot NN".
+"""
+
+import io
+import os
+import tempfile
+
+from vi import dotlan
+from vi.cache.cache import Cache
+from vi.resources import resourcePath
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+REGION = "Providencecatch"
+
+
+def loadLines(name):
+    """ The lines of the corpus file name (intel or local)
+    """
+    with io.open(os.path.join(DATA_DIRECTORY, name + ".txt"), encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def useTemporaryCache():
+    """ The benchmarks must not touch the cache of a real installation
+    """
+    directory = tempfile.mkdtemp(prefix="vintel-benchmark-")
+    Cache.PATH_TO_CACHE = os.path.join(directory, "cache.sqlite3")
+    return directory
+
+
+def loadMap(region=REGION):
+    """ The map from the svg bundled with vintel
+    """
+    with io.open(resourcePath("vi/ui/res/mapdata/{0}.svg".format(region)), encoding="utf-8") as svgFile:
+        svg = svgFile.read()
+    return dotlan.Map(region, svg)
@@ -0,0 +1,93 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" Reading and writing chat logs the way the EVE client does: UTF-16 with
+    a header, one line per message.
+"""
+
+import io
+import os
+
+from vi.chatparser.chatparser import TIMESTAMP_FORMAT, parseTimestamp, splitLine
+
+# the 12 lines the client writes before the first message
+HEADER = (u"﻿\r\n"
+          u"\r\n"
+          u"\r\n"
+          u"        ---------------------------------------------------------------\r\n"
+          u"\r\n"
+          u"          Channel ID:      {channelId}\r\n"
+          u"          Channel Name:    {room}\r\n"
+          u"          Listener:        {listener}\r\n"
+          u"          Session started: {sessionStart}\r\n"
+          u"        ---------------------------------------------------------------\r\n"
+          u"\r\n"
+          u"\r\n")
+
+
+def logFilename(room, sessionStart):
+    """ room_20160311_190000.txt, the chat parser takes the room from it
+    """
+    return u"{0}_{1}.txt".format(room, sessionStart.strftime("%Y%m%d_%H%M%S"))
+
+
+def createLog(directory, room, listener, sessionStart, channelId=None):
+    """ Creates the log with its header and returns its path
+    """
+    path = os.path.join(directory, logFilename(room, sessionStart))
+    header = HEADER.format(channelId=channelId or room.lower(), room=room, listener=listener,
+                           sessionStart=sessionStart.strftime(TIMESTAMP_FORMAT))
+    with io.open(path, "wb") as f:
+        f.write(header.encode("utf-16-le"))
+    return path
+
+
+def formatLine(timestamp, user, text):
+    return u"[ {0} ] {1} > {2}\r\n".format(timestamp.strftime(TIMESTAMP_FORMAT), user, text)
+
+
+def appendLines(path, lines):
+    """ Appends the formatted lines with one write, like the client does
+    """
+    with io.open(path, "ab") as f:
+        f.write(u"".join(lines).encode("utf-16-le"))
+
+
+def readLog(path):
+    """ Reads a recorded log and returns (room, listener, lines), lines as
+        list of (timestamp, user, text)
+    """
+    with io.open(path, "rb") as f:
+        content = f.read().decode("utf-16")
+    room = os.path.basename(path)[:-20]
+    listener = None
+    lines = []
+    for line in content.split(u"\n"):
+        line = line.strip()
+        if line.startswith(u"Listener:"):
+            listener = line[line.find(u":") + 1:].strip()
+        elif line.startswith(u"Channel Name:"):
+            room = line[line.find(u":") + 1:].strip()
+        elif line.startswith(u"["):
+            timeStr, user, text = splitLine(line)
+            try:
+                lines.append((parseTimestamp(timeStr), user, text))
+            except ValueError:
+                continue
+    return room, listener, lines
@@ -0,0 +1,162 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" Measures how many lines per second the parts of the chat parser do with
+    the corpus and writes the results as JSON, so runs can be compared:
+        python -m benchmarks.chatparsing [--repeat 5] [--output results.json]
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+from vi.chatparser.chatparser import ChatParser, splitLine
+from vi.chatparser.parser_functions import findShip, findSystem, parseShips, parseStatus, parseSystems
+from vi.chatparser.tokenizer import parseLine
+
+from . import RESULTS_DIRECTORY, REGION, loadLines, loadMap, useTemporaryCache
+
+INTEL_ROOM = "Benchmark Intel"
+
+
+def soups(texts):
+    return [BeautifulSoup(u"<rtext>{0}</rtext>".format(text), 'html.parser').select("rtext")[0] for text in texts]
+
+
+def best(run, prepare, repeat):
+    """ The best time of repeat runs. prepare gives the argument of run and
+        is not measured
+    """
+    times = []
+    for _ in range(repeat):
+        argument = prepare()
+        start = time.time()
+        run(argument)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def benchmark(repeat):
+    logDirectory = useTemporaryCache()
+    dotlanMap = loadMap()
+    systems = dotlanMap.systems
+    intelLines = loadLines("intel")
+    localLines = loadLines("local")
+    texts = [splitLine(line)[2] for line in intelLines]
+
+    def newChatParser():
+        for system in systems.values():
+            del system.messages[:]
+        return ChatParser(logDirectory, [INTEL_ROOM], systems, dotlanMap.systemNameIndex)
+
+    def lineToMessage(chatparser):
+        for line in intelLines:
+            chatparser._lineToMessage(line, INTEL_ROOM)
+
+    def newLocalChatParser():
+        chatparser = newChatParser()
+        chatparser.fileData["local"] = {"charname": "Anon Pilot"}
+        return chatparser
+
+    def parseLocal(chatparser):
+        chatparser.parseLines("Local", localLines, "local")
+
+    def ships(rtexts):
+        for rtext in rtexts:
+            while parseShips(rtext):
+                continue
+
+    def systemsOf(rtexts):
+        for rtext in rtexts:
+            found = set()
+            while parseSystems(systems, rtext, found, dotlanMap.systemNameIndex):
+                continue
+
+    def findShips(texts):
+        for text in texts:
+            findShip(text)
+
+    def findSystems(texts):
+        for text in texts:
+            findSystem(systems, text, dotlanMap.systemNameIndex)
+
+    def tokenize(texts):
+        for text in texts:
+            parseLine(systems, text, dotlanMap.systemNameIndex)
+
+    statusSoups = soups(texts)
+
+    def status(rtexts):
+        for rtext in rtexts:
+            parseStatus(rtext)
+
+    drivers = (
+        ("_lineToMessage", lineToMessage, newChatParser, len(intelLines)),
+        ("parseSystems", systemsOf, lambda: soups(texts), len(texts)),
+        ("parseShips", ships, lambda: soups(texts), len(texts)),
+        ("parseStatus", status, lambda: statusSoups, len(texts)),
+        ("parseLine", tokenize, lambda: texts, len(texts)),
+        ("findSystem", findSystems, lambda: texts, len(texts)),
+        ("findShip", findShips, lambda: texts, len(texts)),
+        ("parseLocal", parseLocal, newLocalChatParser, len(localLines)),
+    )
+    results = {}
+    for name, run, prepare, lines in drivers:
+        seconds = best(run, prepare, repeat)
+        results[name] = {"lines": lines, "seconds": seconds, "linesPerSec": lines / seconds if seconds else None}
+        print("{0:<16} {1:>10.0f} lines/s".format(name, results[name]["linesPerSec"] or 0))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the chat parser")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of every benchmark, the best counts")
+    parser.add_argument("--output", help="the JSON file for the results (default: in benchmarks/results)")
+    args = parser.parse_args()
+
+    now = datetime.datetime.now()
+    results = {
+        "benchmark": "chatparsing",
+        "time": now.isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "map": REGION,
+        "repeat": args.repeat,
+        "results": benchmark(args.repeat),
+    }
+    output = args.output
+    if not output:
+        if not os.path.exists(RESULTS_DIRECTORY):
+            os.makedirs(RESULTS_DIRECTORY)
+        output = os.path.join(RESULTS_DIRECTORY, "chatparsing-{0}.json".format(now.strftime("%Y%m%d-%H%M%S")))
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("Results written to", output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" Replays recorded chat logs into a temporary Chatlogs directory, in real
+    time or faster, and measures for every intel line how long it takes from
+    writing the line to the parsed message and to the updated map:
+        python -m benchmarks.replay [logs directory] [--speed 10] [--output results.json]
+    Without a directory the corpus of the benchmarks is replayed.
+    FileWatcher, ChatParser and the map run like in vintel, only without the
+    window. Local is replayed too (for the load), but not measured.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import datetime
+import glob
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from six.moves import queue
+
+from PyQt4 import QtCore
+from PyQt4.QtCore import SIGNAL
+
+from vi import filewatcher, states
+from vi.chatparser.chatparser import LOCAL_NAMES, ChatParser, splitLine, parseTimestamp
+
+from . import RESULTS_DIRECTORY, loadLines, loadMap, useTemporaryCache
+from .chatlogs import appendLines, createLog, formatLine, readLog
+
+CORPUS_ROOM = "Benchmark Intel"
+CORPUS_LISTENER = "Anon Listener"
+# How long we wait for the last lines after the replay
+GRACE_SECS = 2.0
+
+
+def corpusLogs():
+    """ The corpus as recorded logs: (room, listener, lines)
+    """
+    logs = []
+    for room, name in ((CORPUS_ROOM, "intel"), ("Local", "local")):
+        lines = []
+        for line in loadLines(name):
+            timeStr, user, text = splitLine(line)
+            lines.append((parseTimestamp(timeStr), user, text))
+        logs.append((room, CORPUS_LISTENER, lines))
+    return logs
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+
+class Replay(object):
+
+    def __init__(self, recordedLogs, logDirectory, speed):
+        self.speed = speed
+        self.writeTimes = collections.defaultdict(collections.deque)  # (room, user, text): write times
+        self.lock = threading.Lock()
+        self.written = 0
+        self.measured = 0
+        self.finished = False
+        self.events = []  # (seconds after start, path, user, text)
+        start = min(lines[0][0] for _, _, lines in recordedLogs if lines)
+        now = datetime.datetime.utcnow()
+        self.rooms = []
+        for number, (room, listener, lines) in enumerate(recordedLogs):
+            # a session start of its own, logs of one room must not share a file
+            sessionStart = now + datetime.timedelta(seconds=number)
+            path = createLog(logDirectory, room, listener or CORPUS_LISTENER, sessionStart)
+            if room not in LOCAL_NAMES and room not in self.rooms:
+                self.rooms.append(room)
+            for timestamp, user, text in lines:
+                offset = (timestamp - start).total_seconds() / speed
+                self.events.append((offset, path, room, user, text))
+        self.events.sort(key=lambda event: event[0])
+
+    def write(self):
+        """ Writes the lines when they are due, run in its own thread
+        """
+        start = time.time()
+        index = 0
+        while index < len(self.events):
+            due = start + self.events[index][0]
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            # all lines due now, per log
+            lines = collections.OrderedDict()
+            now = time.time()
+            timestamp = datetime.datetime.utcnow()
+            while index < len(self.events) and start + self.events[index][0] <= now:
+                _, path, room, user, text = self.events[index]
+                lines.setdefault(path, []).append((room, user, text))
+                index += 1
+            for path, pathLines in lines.items():
+                with self.lock:
+                    writeTime = time.time()
+                    for room, user, text in pathLines:
+                        if room not in LOCAL_NAMES and len(text.strip()) > 0:
+                            self.writeTimes[(room, user, text.strip())].append(writeTime)
+                appendLines(path, [formatLine(timestamp, user, text) for room, user, text in pathLines])
+                self.written += len(pathLines)
+        self.finished = True
+
+    def writeTimeOf(self, message):
+        text = message.plainText or message.message
+        if message.room.startswith("="):
+            text = text[4:]
+        with self.lock:
+            times = self.writeTimes.get((message.room, message.user, text))
+            if times:
+                return times.popleft()
+        return None
+
+
+def replay(recordedLogs, speed, batchWindow):
+    useTemporaryCache()
+    logDirectory = tempfile.mkdtemp(prefix="vintel-replay-")
+    replay = Replay(recordedLogs, logDirectory, speed)
+    dotlanMap = loadMap()
+    chatparser = ChatParser(logDirectory, replay.rooms, dotlanMap.systems, dotlanMap.systemNameIndex)
+
+    application = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication(sys.argv)
+    changes = queue.Queue()
+    watcher = filewatcher.FileWatcher(logDirectory, batchWindow=batchWindow)
+    watcher.setFileFilter(chatparser.isWatchedFile)
+    # no event loop here, the changes come through the queue
+    QtCore.QObject.connect(watcher, SIGNAL("file_changes"), changes.put, QtCore.Qt.DirectConnection)
+    watcher.paused = False
+    watcher.start()
+
+    parseLatencies = []
+    mapLatencies = []
+    busySecs = 0.0
+    writer = threading.Thread(target=replay.write)
+    writer.daemon = True
+    replayStart = time.time()
+    writer.start()
+    lastChange = time.time()
+    while not (replay.finished and time.time() - lastChange > GRACE_SECS):
+        try:
+            paths = changes.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        lastChange = busyStart = time.time()
+        messages = []
+        for path in paths:
+            messages.extend(chatparser.fileModified(path))
+        parsed = time.time()
+        for message in messages:
+            if message.status not in (states.LOCATION, states.IGNORE, states.KOS_STATUS_REQUEST):
+                for system in message.systems:
+                    system.setStatus(message.status)
+        dotlanMap.svg
+        mapUpdated = time.time()
+        busySecs += mapUpdated - busyStart
+        for message in messages:
+            writeTime = replay.writeTimeOf(message)
+            if writeTime is not None:
+                replay.measured += 1
+                parseLatencies.append(parsed - writeTime)
+                mapLatencies.append(mapUpdated - writeTime)
+    replayDuration = time.time() - replayStart - GRACE_SECS
+    watcher.quit()
+    watcher.wait()
+
+    def milliseconds(value):
+        return None if value is None else value * 1000
+
+    return {
+        "linesWritten": replay.written,
+        "linesMeasured": replay.measured,
+        "linesLost": sum(len(times) for times in replay.writeTimes.values()),
+        "replaySecs": replayDuration,
+        "busySecs": busySecs,
+        "linesPerSec": replay.written / replayDuration if replayDuration > 0 else None,
+        "parseLatencyMs": {"p50": milliseconds(percentile(parseLatencies, 50)),
+                           "p99": milliseconds(percentile(parseLatencies, 99))},
+        "mapLatencyMs": {"p50": milliseconds(percentile(mapLatencies, 50)),
+                         "p99": milliseconds(percentile(mapLatencies, 99))},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays chat logs and measures the alarm latency")
+    parser.add_argument("logs", nargs="?", help="directory with the recorded logs (default: the corpus)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay N times faster than recorded")
+    parser.add_argument("--batch-window", type=float, default=filewatcher.DEFAULT_BATCH_WINDOW,
+                        help="batch window of the file watcher in seconds")
+    parser.add_argument("--output", help="the JSON file for the results (default: in benchmarks/results)")
+    args = parser.parse_args()
+
+    if args.logs:
+        recordedLogs = [readLog(path) for path in sorted(glob.glob(os.path.join(args.logs, "*.txt")))]
+    else:
+        recordedLogs = corpusLogs()
+    results = replay(recordedLogs, args.speed, args.batch_window)
+    print("{linesWritten} lines in {replaySecs:.1f}s ({linesPerSec:.1f} lines/s), "
+          "{linesMeasured} intel messages measured, {linesLost} lost".format(**results))
+    print("write -> message: p50 {p50:.1f} ms, p99 {p99:.1f} ms".format(**results["parseLatencyMs"]))
+    print("write -> map:     p50 {p50:.1f} ms, p99 {p99:.1f} ms".format(**results["mapLatencyMs"]))
+
+    now = datetime.datetime.now()
+    results.update({"benchmark": "replay", "time": now.isoformat(), "speed": args.speed,
+                    "batchWindow": args.batch_window, "python": sys.version.split()[0]})
+    output = args.output
+    if not output:
+        if not os.path.exists(RESULTS_DIRECTORY):
+            os.makedirs(RESULTS_DIRECTORY)
+        output = os.path.join(RESULTS_DIRECTORY, "replay-{0}.json".format(now.strftime("%Y%m%d-%H%M%S")))
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("Results written to", output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" Writes an intel storm into a Chatlogs directory, to watch CPU and memory
+    of a running vintel under load:
+        python -m benchmarks.storm <Chatlogs directory> --rate 50 --channels 10
+    Every channel gets its own log with the header of the client, the
+    reports are made of the systems of the map and evegate.SHIPNAMES. The
+    characters write Local logs and jump through the map (--jumps per
+    second over all of them). The rooms must be watched by vintel, they are
+    printed at the start.
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import random
+import sys
+import time
+
+from vi import evegate
+
+from . import REGION, loadMap, useTemporaryCache
+from .chatlogs import appendLines, createLog, formatLine
+
+# How often we write, lines due in between are written together
+TICK_SECS = 0.1
+
+
+class ReportGenerator(object):
+    """ Random intel reports like the ones in the channels
+    """
+
+    def __init__(self, systemNames, shipNames, pilots, seed=None):
+        self.random = random.Random(seed)
+        self.systemNames = systemNames
+        self.shipNames = shipNames
+        self.pilots = pilots
+        self.templates = (
+            (10, lambda: u"{0} {1}".format(self.system(), self.ships())),
+            (6, lambda: u"{0} {1} {2}".format(self.system(), self.pilot(), self.ships())),
+            (4, lambda: u"{0} +{1} {2}, {3}".format(self.system(), self.random.randint(2, 60), self.ships(), self.ships())),
+            (4, lambda: u"{0}  {1} nv".format(self.system(), self.pilot())),
+            (5, lambda: u"{0} clr".format(self.system())),
+            (2, lambda: u"clr"),
+            (4, lambda: u"{0}?".format(self.system())),
+            (3, lambda: u"status {0}".format(self.system())),
+            (2, lambda: u"{0} gate {1} {2}".format(self.random.choice(self.systemNames), self.system(), self.ships())),
+            (2, lambda: u"https://zkillboard.com/kill/{0}/".format(self.random.randint(50000000, 60000000))),
+            (1, lambda: u"o7"),
+        )
+        self.totalWeight = sum(weight for weight, _ in self.templates)
+
+    def system(self):
+        """ The name of a system, as short as the pilots write it
+        """
+        name = self.random.choice(self.systemNames)
+        form = self.random.random()
+        if form < 0.2:
+            name = name[:self.random.randint(2, 4)]
+        elif form < 0.3 and "-" in name:
+            first, second = name.split("-", 1)
+            name = u"{0}-{1}".format(first[:2], second[:2])
+        return name.lower() if self.random.random() < 0.4 else name
+
+    def ships(self):
+        ship = self.random.choice(self.shipNames).title()
+        if self.random.random() < 0.25:
+            ship = u"{0}x {1}".format(self.random.randint(2, 9), ship)
+        return ship
+
+    def pilot(self):
+        return self.random.choice(self.pilots)
+
+    def report(self):
+        choice = self.random.uniform(0, self.totalWeight)
+        for weight, template in self.templates:
+            choice -= weight
+            if choice <= 0:
+                return template()
+        return self.templates[0][1]()
+
+
+def storm(directory, rooms, characters, rate, jumps, duration, seed=None):
+    useTemporaryCache()
+    dotlanMap = loadMap()
+    systems = list(dotlanMap.systems.values())
+    pilots = [u"Storm Pilot {0:03d}".format(number) for number in range(200)]
+    generator = ReportGenerator([system.name for system in systems], list(evegate.SHIPNAMES), pilots, seed)
+    rand = generator.random
+    now = datetime.datetime.utcnow()
+
+    channels = [createLog(directory, room, u"Storm Listener", now) for room in rooms]
+    locations = {}
+    for number in range(characters):
+        name = u"Storm Character {0:03d}".format(number)
+        path = createLog(directory, u"Local", name, now + datetime.timedelta(seconds=number), channelId=u"local")
+        locations[path] = rand.choice(systems)
+
+    start = time.time()
+    lastTick = start
+    dueLines = 0.0
+    dueJumps = 0.0
+    written = 0
+    while time.time() - start < duration:
+        time.sleep(TICK_SECS)
+        tick = time.time()
+        dueLines += (tick - lastTick) * rate
+        dueJumps += (tick - lastTick) * jumps
+        lastTick = tick
+        timestamp = datetime.datetime.utcnow()
+        lines = {}
+        while dueLines >= 1:
+            dueLines -= 1
+            lines.setdefault(rand.choice(channels), []).append(formatLine(timestamp, generator.pilot(), generator.report()))
+        while dueJumps >= 1 and locations:
+            dueJumps -= 1
+            path = rand.choice(list(locations.keys()))
+            neighbours = list(locations[path].getNeighbours(1).keys())
+            system = rand.choice(neighbours) if neighbours else rand.choice(systems)
+            locations[path] = system
+            text = u"Channel changed to Local : {0}*".format(system.name)
+            lines.setdefault(path, []).append(formatLine(timestamp, u"EVE System", text))
+        for path, pathLines in lines.items():
+            appendLines(path, pathLines)
+            written += len(pathLines)
+    return written, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes an intel storm into a Chatlogs directory")
+    parser.add_argument("directory", help="the Chatlogs directory vintel watches")
+    parser.add_argument("--rate", type=float, default=50, help="intel lines per second over all channels")
+    parser.add_argument("--channels", type=int, default=10, help="how many intel channels")
+    parser.add_argument("--rooms", help="comma separated names of the channels (default: Storm Intel 01, ...)")
+    parser.add_argument("--characters", type=int, default=20, help="how many characters write Local logs")
+    parser.add_argument("--jumps", type=float, default=2, help="system changes per second over all characters")
+    parser.add_argument("--duration", type=float, default=60, help="how long the storm lasts in seconds")
+    parser.add_argument("--seed", type=int, help="seed for the random reports")
+    args = parser.parse_args()
+
+    if args.rooms:
+        rooms = [room.strip() for room in args.rooms.split(",") if room.strip()]
+    else:
+        rooms = [u"Storm Intel {0:02d}".format(number + 1) for number in range(args.channels)]
+    print("Map {0}, watch these rooms in vintel: {1}".format(REGION, ",".join(rooms)))
+    sys.stdout.flush()
+    written, seconds = storm(args.directory, rooms, args.characters, args.rate, args.jumps, args.duration, args.seed)
+    print("{0} lines in {1:.1f}s ({2:.1f} lines/s)".format(written, seconds, written / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -150,6 +150,32 @@ class Cache(object):
             self.con.execute(query, (name,))
             self.con.commit()
 
+    def putCheckpoints(self, checkpoints):
+        """ Replaces the stored checkpoints of the chatlogs. checkpoints is a
+            list of dicts with the keys path, offset, size, mtime, charname and
+            sessionstart
+        """
+        with Cache.SQLITE_WRITE_LOCK:
+            self.con.execute("DELETE FROM checkpoints")
+            query = "INSERT INTO checkpoints (path, offset, size, mtime, charname, sessionstart, modified) " \
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+            now = time.time()
+            for checkpoint in checkpoints:
+                self.con.execute(query, (checkpoint["path"], checkpoint["offset"], checkpoint["size"],
+                                         checkpoint["mtime"], checkpoint.get("charname"),
+                                         checkpoint.get("sessionstart"), now))
+            self.con.commit()
+
+    def getCheckpoints(self):
+        """ Getting the stored checkpoints of the chatlogs as dict path: checkpoint
+        """
+        query = "SELECT path, offset, size, mtime, charname, sessionstart FROM checkpoints"
+        checkpoints = {}
+        for row in self.con.execute(query).fetchall():
+            checkpoints[row[0]] = {"path": row[0], "offset": row[1], "size": row[2], "mtime": row[3],
+                                   "charname": row[4], "sessionstart": row[5]}
+        return checkpoints
+
     def recallAndApplySettings(self, responder, settingsIdentifier):
         settings = self.getFromCache(settingsIdentifier)
         if settings:
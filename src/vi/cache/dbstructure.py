@@ -41,6 +41,10 @@ def updateDatabase(oldVersion, con):
     if oldVersion < 3:
         queries += ["CREATE TABLE cache (key VARCHAR PRIMARY KEY, data BLOB, modified INT, maxage INT)",
                     "UPDATE version SET version = 3"]
+    if oldVersion < 4:
+        queries += ["CREATE TABLE checkpoints (path VARCHAR PRIMARY KEY, offset INT, size INT, mtime REAL, "
+                    "charname VARCHAR, sessionstart VARCHAR, modified INT)",
+                    "UPDATE version SET version = 4"]
     for query in queries:
         con.execute(query)
     for update in databaseUpdates:
@@ -0,0 +1,143 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" At startup the intel of the last minutes is allready in the logs, but we
+    only read what is written after the start. The backfill reads the tails
+    of the intel logs in a pool of processes (only text, no Qt or map
+    objects go there), merges the lines of all logs by their timestamps and
+    hands them to the ChatParser, as if they had been parsed there.
+"""
+
+import sys
+import datetime
+import heapq
+import logging
+import multiprocessing
+
+from vi import states
+from vi.dotlan import SystemNameIndex
+
+from .chatparser import MESSAGE_EXPIRY_SECS, parseTimestamp, splitLine
+from .tokenizer import parseLine
+
+# How much of the end of a log we read, 20 minutes of a busy room fit in
+TAIL_BYTES = 256 * 1024
+
+# Spawned processes import Vintel again (with Qt), which takes longer than
+# parsing some MB here, so the pool is only used for this much of tails
+POOL_MIN_BYTES = 32 * 1024 * 1024
+
+# The systems in a worker process, as dict name: name
+_systems = {}
+_systemNameIndex = None
+
+
+def _initWorker(systemNames):
+    global _systems, _systemNameIndex
+    _systems = dict((name, name) for name in systemNames)
+    _systemNameIndex = SystemNameIndex(_systems)
+
+
+def parseLogTail(job):
+    """ Parses the lines of the log since the given time. job is a tuple
+        (path, roomname, offset, since), only the bytes before offset are
+        read. Returns the lines as list of tuples (timestamp, roomname,
+        username, text, html, systemnames, status) in the order of the log
+    """
+    path, roomname, offset, since = job
+    start = max(0, offset - TAIL_BYTES)
+    start -= start % 2  # utf-16, 2 bytes a char
+    try:
+        with open(path, "rb") as f:
+            f.seek(start)
+            content = f.read(offset - start).decode("utf-16-le", "replace")
+    except (IOError, OSError) as e:
+        logging.error("Backfill of %s failed: %s", path, e)
+        return []
+    lines = content.split("\n")
+    if start > 0:
+        # we started somewhere in the first line
+        lines = lines[1:]
+    parsed = []
+    for line in lines:
+        line = line.strip()
+        if len(line) <= 2:
+            continue
+        timeStr, username, text = splitLine(line)
+        try:
+            timestamp = parseTimestamp(timeStr)
+        except ValueError:
+            continue  # the header
+        if timestamp < since:
+            continue
+        upperText = text.upper()
+        if upperText.startswith("XXX ") or upperText.startswith("VINTELSOUND_TEST"):
+            continue
+        html, systemNames, status = parseLine(_systems, text, _systemNameIndex)
+        if status is None:
+            status = states.ALARM
+        parsed.append((timestamp, roomname, username, text, html, tuple(sorted(systemNames)), status))
+    return parsed
+
+
+def _poolContext():
+    """ The pool processes must not be forked: Vintel has its Qt threads
+        running then, and a fork copies the locks they hold. Returns what
+        starts them without fork, None if there is nothing (Python 2
+        outside of Windows)
+    """
+    if sys.platform.startswith("win"):
+        return multiprocessing
+    getContext = getattr(multiprocessing, "get_context", None)
+    return getContext("spawn") if getContext else None
+
+
+def backfill(chatparser, maxAge=MESSAGE_EXPIRY_SECS, processes=None):
+    """ Parses the intel of the last maxAge seconds from the logs and adds
+        it to the chatparser. Returns the new messages in timestamp order
+    """
+    since = datetime.datetime.utcnow() - datetime.timedelta(seconds=maxAge)
+    jobs = [(path, roomname, offset, since) for path, roomname, offset in chatparser.recentLogs(maxAge)]
+    if not jobs:
+        return []
+    systemNames = list(chatparser.systems.keys())
+    results = None
+    context = _poolContext()
+    tailBytes = sum(min(offset, TAIL_BYTES) for _, _, offset, _ in jobs)
+    if tailBytes >= POOL_MIN_BYTES and len(jobs) > 1 and processes != 1 and context is not None:
+        processes = processes or min(len(jobs), multiprocessing.cpu_count())
+        try:
+            pool = context.Pool(processes, _initWorker, (systemNames,))
+            try:
+                results = pool.map(parseLogTail, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        except Exception as e:
+            logging.error("Backfill in processes failed, doing it here: %s", e)
+    if results is None:
+        _initWorker(systemNames)
+        results = [parseLogTail(job) for job in jobs]
+    messages = []
+    for timestamp, roomname, username, text, html, systemNames, status in heapq.merge(*results):
+        message = chatparser.addParsedLine(roomname, timestamp, username, text, html, systemNames, status)
+        if message:
+            messages.append(message)
+    logging.info("Backfill found %d messages in %d logs", len(messages), len(jobs))
+    return messages
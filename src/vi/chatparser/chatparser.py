@@ -17,114 +17,336 @@
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import codecs
 import datetime
 import os
 import time
 import six
+from collections import OrderedDict, deque, namedtuple
 if six.PY2:
     from io import open
 
-from bs4 import BeautifulSoup
 from vi import states
+from vi.cache.cache import Cache
+from vi.dotlan import SystemNameIndex
 from PyQt4.QtGui import QMessageBox
 
 
-from .parser_functions import parseStatus
-from .parser_functions import parseUrls, parseShips, parseSystems
+from .tokenizer import parseLine
 
 # Names the local chatlogs could start with (depends on l10n of the client)
 LOCAL_NAMES = ("Local", "Lokal", six.text_type("\u041B\u043E\u043A\u0430\u043B\u044C\u043D\u044B\u0439"))
 
+# How long a message is of interest (for duplicates and on the map)
+MESSAGE_EXPIRY_SECS = 20 * 60
+
+# A clear without a system belongs to a request of the same room from
+# the last CLEAR_CORRELATION_SECS, we keep the last REQUESTS_PER_ROOM requests
+CLEAR_CORRELATION_SECS = 5 * 60
+REQUESTS_PER_ROOM = 5
+
+# How many intel lines we remember to drop their copies from other logs
+PARSED_LINES_CACHE_SIZE = 512
+
+# The format of the timestamps in the logs
+TIMESTAMP_FORMAT = "%Y.%m.%d %H:%M:%S"
+
+# The header of a log is about 800 bytes, we read it in chunks of this size
+HEADER_BYTES = 1024
+
+
+# the date part of the last timestamp and its (year, month, day). It is only
+# replaced as a whole, more than one thread parses timestamps
+_lastDate = (None, None)
+
+
+def parseTimestamp(timeStr):
+    """ datetime.strptime(timeStr, TIMESTAMP_FORMAT), but much faster for
+        the fixed "YYYY.MM.DD HH:MM:SS" of the logs. The date part is
+        remembered, the lines of a log mostly have the same.
+    """
+    global _lastDate
+    if (len(timeStr) == 19 and timeStr[4] == "." and timeStr[7] == "." and timeStr[10] == " "
+            and timeStr[13] == ":" and timeStr[16] == ":"):
+        try:
+            dateStr = timeStr[:10]
+            lastDateStr, lastDate = _lastDate
+            if dateStr == lastDateStr:
+                year, month, day = lastDate
+            else:
+                if not (dateStr[:4].isdigit() and dateStr[5:7].isdigit() and dateStr[8:].isdigit()):
+                    raise ValueError(timeStr)
+                year, month, day = int(dateStr[:4]), int(dateStr[5:7]), int(dateStr[8:])
+                # invalid dates raise the ValueError here, before we remember them
+                datetime.date(year, month, day)
+                _lastDate = (dateStr, (year, month, day))
+            hour, minute, second = timeStr[11:13], timeStr[14:16], timeStr[17:]
+            if hour.isdigit() and minute.isdigit() and second.isdigit():
+                return datetime.datetime(year, month, day, int(hour), int(minute), int(second))
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(timeStr, TIMESTAMP_FORMAT)
+
+
+def splitLine(line):
+    """ Splits a line of a log into the string of its timestamp, the name
+        of the poster and the pure message
+    """
+    # finding the timestamp
+    timeStart = line.find("[") + 1
+    timeEnds = line.find("]")
+    timeStr = line[timeStart:timeEnds].strip()
+    # finding the username of the poster
+    userEnds = line.find(">")
+    username = line[timeEnds + 1:userEnds].strip()
+    # finding the pure message
+    text = line[userEnds + 1:].strip()  # text will the text to work an
+    return timeStr, username, text
+
 
 class ChatParser(object):
     """ ChatParser will analyze every new line that was found inside the Chatlogs.
     """
 
-    def __init__(self, path, rooms, systems):
+    def __init__(self, path, rooms, systems, systemNameIndex=None):
         """ path = the path with the logs
-            rooms = the rooms to parse"""
+            rooms = the rooms to parse
+            systemNameIndex = the dotlan.SystemNameIndex of the systems"""
         self.path = path  # the path with the chatlog
         self.rooms = rooms  # the rooms to watch (excl. local)
         self.systems = systems  # the known systems as dict name: system
+        self.systemNameIndex = systemNameIndex or SystemNameIndex(systems)
         self.fileData = {}  # informations about the files in the directory
-        self.knownMessages = []  # message we allready analyzed
+        self.knownMessages = RecentMessages()  # message we allready analyzed
+        self.recentRequests = {}  # the last requests with systems per room
+        self.parsedLines = ParsedLinesCache()  # intel lines we allready parsed
+        self.clearCorrelationSecs = CLEAR_CORRELATION_SECS
         self.locations = {}  # informations about the location of a char
         self.ignoredPaths = []
+        # called with (title, text) instead of showing a QMessageBox, f.e.
+        # if we are not used by the GUI thread
+        self.warningHandler = None
         self._collectInitFileData(path)
 
     def _collectInitFileData(self, path):
         currentTime = time.time()
         maxDiff = 60 * 60 * 24  # what is 1 day in seconds
+        checkpoints = Cache().getCheckpoints()
         for filename in os.listdir(path):
             fullPath = os.path.join(path, filename)
-            fileTime = os.path.getmtime(fullPath)
-            if currentTime - fileTime < maxDiff:
-                self.addFile(fullPath)
+            if fullPath in self.fileData or not self.isWatchedFile(fullPath):
+                continue
+            fileStat = os.stat(fullPath)
+            if currentTime - fileStat.st_mtime < maxDiff:
+                checkpoint = checkpoints.get(fullPath)
+                if checkpoint and checkpoint["size"] == fileStat.st_size and checkpoint["mtime"] == fileStat.st_mtime \
+                        and (checkpoint["charname"] or filename[:-20] not in LOCAL_NAMES):
+                    self._restoreCheckpoint(checkpoint)
+                else:
+                    self.addFile(fullPath)
+
+    def isWatchedRoom(self, roomname):
+        """ Only the intel rooms, local and the kos rooms (starting with =)
+            are of interest, all the other logs are never opened
+        """
+        return roomname in self.rooms or roomname in LOCAL_NAMES or roomname.startswith("=")
+
+    def isWatchedFile(self, path):
+        # EvE names the file like room_20140913_200737.txt
+        return self.isWatchedRoom(os.path.basename(path)[:-20])
+
+    def takeOverFiles(self, previous):
+        """ Continues to read the logs where the previous parser (of another
+            map) stopped, so no line is lost or read twice. The locations of
+            the chars go along.
+        """
+        for path, data in previous.fileData.items():
+            if self.isWatchedFile(path):
+                self.fileData[path] = data
+        self.ignoredPaths = previous.ignoredPaths
+        self.locations = previous.locations
+        self.parsedLines = previous.parsedLines
+
+    def setRooms(self, rooms):
+        """ Changes the rooms to watch. The logs of rooms we did not watch
+            until now are registered, so only new lines will be parsed.
+        """
+        self.rooms = rooms
+        for path in list(self.fileData.keys()):
+            if not self.isWatchedFile(path):
+                del self.fileData[path]
+        self._collectInitFileData(self.path)
+
+    def _restoreCheckpoint(self, checkpoint):
+        """ The file was not touched since the checkpoint was saved, so we
+            can continue where we stopped without opening it
+        """
+        data = self._newFileData()
+        data["offset"] = checkpoint["offset"]
+        if checkpoint["charname"] and checkpoint["sessionstart"]:
+            data["charname"] = checkpoint["charname"]
+            data["sessionstart"] = parseTimestamp(checkpoint["sessionstart"])
+        self.fileData[checkpoint["path"]] = data
+
+    def saveCheckpoints(self):
+        """ Saves how far we have read every file, so the next start
+            must not read them again
+        """
+        checkpoints = []
+        for path, data in self.fileData.items():
+            if path in self.ignoredPaths:
+                continue
+            # in the middle of the header, the file is read again from its
+            # start next time (for Local we need the name of the char)
+            if data["header"] or (os.path.basename(path)[:-20] in LOCAL_NAMES and "charname" not in data):
+                continue
+            try:
+                fileStat = os.stat(path)
+            except OSError:
+                continue
+            # the unfinished line (and what the decoder holds back) must be read again next time
+            pending = len(data["partial"].encode("utf-16-le")) + len(data["decoder"].getstate()[0])
+            checkpoint = {"path": path, "offset": data["offset"] - pending, "size": fileStat.st_size,
+                          "mtime": fileStat.st_mtime}
+            if "charname" in data:
+                checkpoint["charname"] = data["charname"]
+                checkpoint["sessionstart"] = data["sessionstart"].strftime(TIMESTAMP_FORMAT)
+            checkpoints.append(checkpoint)
+        Cache().putCheckpoints(checkpoints)
 
     def addFile(self, path):
-        lines = None
-        content = ""
+        """ Starts tailing the file at path. Everything that is already in the
+            file counts as read, only lines written later will be parsed.
+        """
         filename = os.path.basename(path)
         roomname = filename[:-20]
+        self.fileData[path] = self._newFileData()
+        try:
+            if roomname in LOCAL_NAMES:
+                # for local-chats we need the header to know whose location it is
+                self._readHeader(path)
+            self.fileData[path]["offset"] = os.path.getsize(path)
+        except Exception as e:
+            self.ignoredPaths.append(path)
+            self._warn("Read a log file failed!", "File: {0} - problem: {1}".format(path, six.text_type(e)))
+
+    def _warn(self, title, text):
+        if self.warningHandler:
+            self.warningHandler(title, text)
+        else:
+            QMessageBox.warning(None, title, text, "OK")
+
+    def _readHeader(self, path):
+        """ Reads the beginning of the file, HEADER_BYTES at a time, until the
+            listener and the session start are found. We give up after
+            16 chunks, there is no header that big.
+        """
+        data = self.fileData[path]
+        decoder = codecs.getincrementaldecoder("utf-16-le")()
+        text = u""
+        with open(path, "rb") as f:
+            while "charname" not in data and f.tell() < HEADER_BYTES * 16:
+                content = f.read(HEADER_BYTES)
+                if not content:
+                    break
+                text += decoder.decode(content)
+                self._parseHeader(path, text.split("\n")[:-1])
+
+    def _newFileData(self, header=0):
+        """ offset = the bytes of the file we already have read
+            partial = an unfinished last line, waiting for the rest of it
+            header = how many of the dashed lines around the header are
+                still to come, the lines until then belong to the header
+        """
+        return {"offset": 0, "decoder": codecs.getincrementaldecoder("utf-16-le")(), "partial": u"",
+                "header": header}
+
+    def _splitHeader(self, data, lines):
+        """ Returns the lines of the header and the lines after it. The
+            header ends with its second dashed line, or before the first
+            line which is a message.
+        """
+        index = 0
+        while data["header"] and index < len(lines):
+            line = lines[index].strip().lstrip(u"\ufeff")
+            if line.startswith(u"["):
+                data["header"] = 0
+                break
+            if line.startswith(u"---"):
+                data["header"] -= 1
+            index += 1
+        return lines[:index], lines[index:]
+
+    def _readNewLines(self, path):
+        """ Reads only the bytes which were appended to the file since the last
+            call and returns the complete lines in them.
+        """
+        data = self.fileData[path]
         try:
-            with open(path, "r", encoding='utf-16-le') as f:
+            with open(path, "rb") as f:
+                f.seek(data["offset"])
                 content = f.read()
+            text = data["partial"] + data["decoder"].decode(content)
         except Exception as e:
             self.ignoredPaths.append(path)
-            QMessageBox.warning(None, "Read a log file failed!", "File: {0} - problem: {1}".format(path, six.text_type(e)), "OK")
+            self._warn("Read a log file failed!", "File: {0} - problem: {1}".format(path, six.text_type(e)))
             return None
-
-        lines = content.split("\n")
-        if path not in self.fileData or (roomname in LOCAL_NAMES and "charname" not in self.fileData.get(path, [])):
-            self.fileData[path] = {}
-            if roomname in LOCAL_NAMES:
-                charname = None
-                sessionStart = None
-                # for local-chats we need more infos
-                for line in lines:
-                    if "Listener:" in line:
-                        charname = line[line.find(":") + 1:].strip()
-                    elif "Session started:" in line:
-                        sessionStr = line[line.find(":") + 1:].strip()
-                        sessionStart = datetime.datetime.strptime(sessionStr, "%Y.%m.%d %H:%M:%S")
-                    if charname and sessionStart:
-                        self.fileData[path]["charname"] = charname
-                        self.fileData[path]["sessionstart"] = sessionStart
-                        break
-        self.fileData[path]["lines"] = len(lines)
+        data["offset"] += len(content)
+        lines = text.split("\n")
+        data["partial"] = lines.pop()
         return lines
 
-    def _lineToMessage(self, line, roomname):
-        # finding the timestamp
-        timeStart = line.find("[") + 1
-        timeEnds = line.find("]")
-        timeStr = line[timeStart:timeEnds].strip()
+    def _parseHeader(self, path, lines):
+        """ Looks for the name of the listener and the start of the session
+            in the header lines of a local chat
+        """
+        charname = None
+        sessionStart = None
+        for line in lines:
+            if "Listener:" in line:
+                charname = line[line.find(":") + 1:].strip()
+            elif "Session started:" in line:
+                sessionStr = line[line.find(":") + 1:].strip()
+                sessionStart = parseTimestamp(sessionStr)
+            if charname and sessionStart:
+                self.fileData[path]["charname"] = charname
+                self.fileData[path]["sessionstart"] = sessionStart
+                break
+
+    def _lineToMessage(self, line, roomname, isKosRoom=None, isIntelRoom=None):
+        """ isKosRoom and isIntelRoom are the same for all lines of a room,
+            they are found here if not given
+        """
+        if isKosRoom is None:
+            isKosRoom = roomname.startswith("=")
+        if isIntelRoom is None:
+            isIntelRoom = roomname in self.rooms
+        timeStr, username, text = splitLine(line)
+        originalText = text
+
+        # Another log (of another client) had the same line just before
+        lineKey = (roomname, timeStr, username, text)
+        timestamp = self.parsedLines.get(lineKey)
+        if timestamp is not None:
+            return Message(roomname, "", timestamp, username, set(), text, originalText, states.IGNORE)
+
         try:
-            timestamp = datetime.datetime.strptime(timeStr, "%Y.%m.%d %H:%M:%S")
+            timestamp = parseTimestamp(timeStr)
         except ValueError:
             return None
-        # finding the username of the poster
-        userEnds = line.find(">")
-        username = line[timeEnds + 1:userEnds].strip()
-        # finding the pure message
-        text = line[userEnds + 1:].strip()  # text will the text to work an
-        originalText = text
-        formatedText = u"<rtext>{0}</rtext>".format(text)
-        soup = BeautifulSoup(formatedText, 'html.parser')
-        rtext = soup.select("rtext")[0]
         systems = set()
         upperText = text.upper()
 
         # KOS request
         if upperText.startswith("XXX "):
             return Message(roomname, text, timestamp, username, systems, upperText, status=states.KOS_STATUS_REQUEST)
-        elif roomname.startswith("="):
+        elif isKosRoom:
             return Message(roomname, "xxx " + text, timestamp, username, systems, "XXX " + upperText, status=states.KOS_STATUS_REQUEST)
         elif upperText.startswith("VINTELSOUND_TEST"):
             return Message(roomname, text, timestamp, username, systems, upperText, status=states.SOUND_TEST)
-        if roomname not in self.rooms:
+        if not isIntelRoom:
             return None
-
+        self.parsedLines.put(lineKey, timestamp)
 
         message = Message(roomname, "", timestamp, username, systems, text, originalText)
         # May happen if someone plays > 1 account
@@ -132,33 +354,70 @@ class ChatParser(object):
             message.status = states.IGNORE
             return message
 
-        while parseShips(rtext):
-            continue
-        while parseUrls(rtext):
-            continue
-        while parseSystems(self.systems, rtext, systems):
-            continue
-        parsedStatus = parseStatus(rtext)
+        html, foundSystems, parsedStatus = parseLine(self.systems, text, self.systemNameIndex)
+        systems.update(foundSystems)
         status = parsedStatus if parsedStatus is not None else states.ALARM
+        return self._addParsedMessage(message, html, status)
 
+    def _addParsedMessage(self, message, html, status):
+        roomname = message.room
+        timestamp = message.timestamp
+        systems = message.systems
         # If message says clear and no system? Maybe an answer to a request?
         if status == states.CLEAR and not systems:
-            maxSearch = 2  # we search only max_search messages in the room
-            for count, oldMessage in enumerate(oldMessage for oldMessage in self.knownMessages[-1::-1] if oldMessage.room == roomname):
-                if oldMessage.systems and oldMessage.status == states.REQUEST:
-                    for system in oldMessage.systems:
-                        systems.add(system)
-                    break
-                if count > maxSearch:
-                    break
-        message.message = six.text_type(rtext)
+            request = self._findRecentRequest(roomname, timestamp)
+            if request:
+                systems.update(request.systems)
+        elif status == states.REQUEST and systems:
+            if roomname not in self.recentRequests:
+                self.recentRequests[roomname] = deque(maxlen=REQUESTS_PER_ROOM)
+            self.recentRequests[roomname].append(message)
+        message.message = html
         message.status = status
-        self.knownMessages.append(message)
-        if systems:
-            for system in systems:
-                system.messages.append(message)
+        self.knownMessages.add(message)
         return message
 
+    def recentLogs(self, maxAge):
+        """ The logs of the intel rooms written in the last maxAge seconds
+            as list of (path, roomname, offset), offset is where we started
+            to read the log
+        """
+        logs = []
+        minTime = time.time() - maxAge
+        for path, data in self.fileData.items():
+            roomname = os.path.basename(path)[:-20]
+            if roomname not in self.rooms or path in self.ignoredPaths:
+                continue
+            try:
+                if os.path.getmtime(path) < minTime:
+                    continue
+            except OSError:
+                continue
+            logs.append((path, roomname, data["offset"]))
+        return logs
+
+    def addParsedLine(self, roomname, timestamp, username, text, html, systemNames, status):
+        """ Adds a line of an intel room, which was parsed somewhere else
+            (see backfill), as if we had parsed it here.
+            Returns the message, None if we allready know it
+        """
+        systems = set(self.systems[name] for name in systemNames if name in self.systems)
+        message = Message(roomname, "", timestamp, username, systems, text, text)
+        if message in self.knownMessages:
+            return None
+        return self._addParsedMessage(message, html, status)
+
+    def _findRecentRequest(self, roomname, timestamp):
+        """ The newest request with systems in the room, not older than
+            clearCorrelationSecs before timestamp
+        """
+        oldest = timestamp - datetime.timedelta(seconds=self.clearCorrelationSecs)
+        for request in reversed(self.recentRequests.get(roomname, ())):
+            if request.timestamp < oldest:
+                break
+            return request
+        return None
+
     def _parseLocal(self, path, line):
         message = []
         """ Parsing a line from the local chat. Can contain the system of the char
@@ -171,7 +430,7 @@ class ChatParser(object):
         timeStart = line.find("[") + 1
         timeEnds = line.find("]")
         timeStr = line[timeStart:timeEnds].strip()
-        timestamp = datetime.datetime.strptime(timeStr, "%Y.%m.%d %H:%M:%S")
+        timestamp = parseTimestamp(timeStr)
 
         # Finding the username of the poster
         userEnds = line.find(">")
@@ -194,7 +453,6 @@ class ChatParser(object):
         return message
 
     def fileModified(self, path):
-        messages = []
         if path in self.ignoredPaths:
             return []
         # Checking if we must do anything with the changed file.
@@ -203,26 +461,117 @@ class ChatParser(object):
         # the last 20 chars
         filename = os.path.basename(path)
         roomname = filename[:-20]
+        if not self.isWatchedRoom(roomname):
+            return []
         if path not in self.fileData:
-            # seems eve created a new file. New Files have 12 lines header
-            self.fileData[path] = {"lines": 13}
-        oldLength = self.fileData[path]["lines"]
-        lines = self.addFile(path)
-        if path in self.ignoredPaths:
+            # seems eve created a new file, it starts with a header
+            # between two dashed lines
+            self.fileData[path] = self._newFileData(header=2)
+        lines = self._readNewLines(path)
+        if lines is None:
             return []
-        for line in lines[oldLength - 1:]:
-            line = line.strip()
-            if len(line) > 2:
-                message = None
-                if roomname in LOCAL_NAMES:
-                    message = self._parseLocal(path, line)
-                else:
-                    message = self._lineToMessage(line, roomname)
+        data = self.fileData[path]
+        headerLines, lines = self._splitHeader(data, lines)
+        if roomname in LOCAL_NAMES and "charname" not in data:
+            # the client may write the header in more than one piece
+            data["headerLines"] = data.get("headerLines", []) + headerLines
+            self._parseHeader(path, data["headerLines"])
+            if "charname" in data:
+                del data["headerLines"]
+        return self.parseLines(roomname, lines, path)
+
+    def parseLines(self, roomname, lines, path=None):
+        """ Parses the lines of a room and returns the messages found in
+            them. Lines of Local are only parsed with the path of their log,
+            we need the name of the char from its header.
+        """
+        messages = []
+        if not self.isWatchedRoom(roomname):
+            return messages
+        lines = [line for line in (line.strip() for line in lines) if len(line) > 2]
+        if roomname in LOCAL_NAMES:
+            if "charname" not in self.fileData.get(path, {}):
+                return messages
+            for line in lines:
+                message = self._parseLocal(path, line)
+                if message:
+                    messages.append(message)
+        else:
+            isKosRoom = roomname.startswith("=")
+            isIntelRoom = roomname in self.rooms
+            for line in lines:
+                message = self._lineToMessage(line, roomname, isKosRoom, isIntelRoom)
                 if message:
                     messages.append(message)
         return messages
 
 
+class RecentMessages(object):
+    """ The messages of the last expirySecs (by the timestamps of the
+        messages), to find the same message in O(1) when it comes again
+        (f.e. from the log of another client of the same player)
+    """
+
+    def __init__(self, expirySecs=MESSAGE_EXPIRY_SECS):
+        self.expiry = datetime.timedelta(seconds=expirySecs)
+        self.messages = deque()  # in the order they were added
+        self.keys = set()
+        self.newest = None  # the newest timestamp we have seen
+
+    def add(self, message):
+        if self.newest is None or message.timestamp > self.newest:
+            self.newest = message.timestamp
+        self.messages.append(message)
+        self.keys.add(message)
+        self._expire()
+
+    def _expire(self):
+        oldest = self.newest - self.expiry
+        while self.messages and self.messages[0].timestamp < oldest:
+            expired = self.messages.popleft()
+            self.keys.discard(expired)
+
+    def __contains__(self, message):
+        return message in self.keys
+
+    def __len__(self):
+        return len(self.messages)
+
+
+class ParsedLinesCache(object):
+    """ LRU cache of the lines we parsed as key (room, time, user, text),
+        counting hits and misses
+    """
+
+    def __init__(self, size=PARSED_LINES_CACHE_SIZE):
+        self.size = size
+        self.lines = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ The timestamp of the line, None if we have not seen it
+        """
+        timestamp = self.lines.get(key)
+        if timestamp is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # the line is the newest again
+        del self.lines[key]
+        self.lines[key] = timestamp
+        return timestamp
+
+    def put(self, key, timestamp):
+        self.lines[key] = timestamp
+        if len(self.lines) > self.size:
+            self.lines.popitem(last=False)
+
+
+# What the parser hands to the GUI of a message, systems as tuple of names
+MessageRecord = namedtuple("MessageRecord", "room message timestamp user systems upperText plainText status")
+
+
 class Message(object):
     def __init__(self, room, message, timestamp, user, systems, upperText, plainText="", status=states.ALARM):
         self.room = room  # chatroom the message was posted
@@ -236,6 +585,13 @@ class Message(object):
         # if you add the message to a widget, please add it to widgets
         self.widgets = []
 
+    def record(self):
+        """ A MessageRecord of the message, the systems by their names
+        """
+        systems = tuple(getattr(system, "name", system) for system in self.systems)
+        return MessageRecord(self.room, self.message, self.timestamp, self.user, systems, self.upperText,
+                             self.plainText, self.status)
+
     def __key(self):
         return (self.room, self.plainText, self.timestamp, self.user)
 
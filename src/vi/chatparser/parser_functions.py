@@ -37,10 +37,12 @@
 
 import six
 
-import vi.evegate as evegate
 from bs4 import BeautifulSoup
 from bs4.element import NavigableString
 from vi import states
+from vi.dotlan import SystemNameIndex
+
+from .shipmatcher import SHIP_MATCHER
 
 CHARS_TO_IGNORE = ("*", "?", ",", "!", ".")
 
@@ -55,8 +57,10 @@ def textReplace(element, newText):
     element.replace_with(six.text_type(""))
 
 
-def parseStatus(rtext):
-    texts = [t for t in rtext.contents if isinstance(t, NavigableString)]
+def statusOfTexts(texts):
+    """ Finds the status of a message in its texts (the parts of the message
+        which are not part of a ship, url or system)
+    """
     for text in texts:
         upperText = text.strip().upper()
         originalText = upperText
@@ -73,6 +77,18 @@ def parseStatus(rtext):
             return states.CLEAR
 
 
+def parseStatus(rtext):
+    texts = [t for t in rtext.contents if isinstance(t, NavigableString)]
+    return statusOfTexts(texts)
+
+
+def findShip(text):
+    """ Returns start and end of the first ship name in text which is
+        not part of another word, or None if there is none
+    """
+    return SHIP_MATCHER.find(text)
+
+
 def parseShips(rtext):
     def formatShipName(text, word):
         newText = u"""<span style="color:#d95911;font-weight:bold"> {0}</span>"""
@@ -81,114 +97,105 @@ def parseShips(rtext):
 
     texts = [t for t in rtext.contents if isinstance(t, NavigableString)]
     for text in texts:
-        upperText = text.upper()
-        for shipName in evegate.SHIPNAMES:
-            if shipName in upperText:
-                hit = True
-                start = upperText.find(shipName)
-                end = start + len(shipName)
-                if ((start > 0 and upperText[start - 1] not in (" ", "X")) or (
-                        end < len(upperText) - 1 and upperText[end] not in ("S", " "))):
-                    hit = False
-                if hit:
-                    shipInText = text[start:end]
-                    formatted = formatShipName(text, shipInText)
-                    textReplace(text, formatted)
-                    return True
-
-
-def parseSystems(systems, rtext, foundSystems):
-    
-    systemNames = systems.keys()
-    
+        hit = findShip(text)
+        if hit:
+            shipInText = text[hit[0]:hit[1]]
+            formatted = formatShipName(text, shipInText)
+            textReplace(text, formatted)
+            return True
+
+
+def findSystem(systems, text, systemNameIndex=None):
+    """ Returns the first word of text, which names a system, together with
+        the name of the system as tuple (word, systemname). None if there
+        is no system mentioned in text.
+        systemNameIndex is the dotlan.SystemNameIndex of systems, it is
+        built here if not given.
+    """
+    if systemNameIndex is None:
+        systemNameIndex = SystemNameIndex(systems)
+
     # words to ignore on the system parser. use UPPER CASE
     WORDS_TO_IGNORE = ("IN", "IS", "AS")
 
+    worktext = text
+    for char in CHARS_TO_IGNORE:
+        worktext = worktext.replace(char, "")
+
+    # Drop redundant whitespace so as to not throw off word index
+    worktext = ' '.join(worktext.split())
+    words = worktext.split(" ")
+
+    for idx, word in enumerate(words):
+
+        # Is this about another a system's gate?
+        if len(words) > idx + 1:
+            if words[idx+1].upper() == 'GATE':
+                bailout = True
+                if len(words) > idx + 2:
+                    if words[idx+2].upper() == 'TO':
+                        # Could be '___ GATE TO somewhere' so check this one.
+                        bailout = False
+                if bailout:
+                    # '_____ GATE' mentioned in message, which is not what we're
+                    # interested in, so go to checking next word.
+                    continue
+
+        upperWord = word.upper()
+        if upperWord != word and upperWord in WORDS_TO_IGNORE: continue
+        if upperWord in systemNameIndex.names:  # - direct hit on name
+            return word, upperWord
+        elif 1 < len(upperWord) < 5:  # - upperWord < 4 chars.
+            system = systemNameIndex.startingWith(upperWord)  # system begins with?
+        elif "-" in upperWord and len(upperWord) > 2:  # - short with - (minus)
+            system = systemNameIndex.matchingDashed(upperWord)  # (I-I will match I43-IF3)
+        elif len(upperWord) > 1:  # what if F-YH58 is named FY?
+            system = systemNameIndex.strippedStartingWith(upperWord)
+        else:
+            system = None
+        if system:
+            return word, system
+    return None
+
+
+def parseSystems(systems, rtext, foundSystems, systemNameIndex=None):
+
     def formatSystem(text, word, system):
         newText = u"""<a style="color:#CC8800;font-weight:bold" href="mark_system/{0}">{1}</a>"""
         text = text.replace(word, newText.format(system, word))
         return text
 
-    texts = [t for t in rtext.contents if isinstance(t, NavigableString) and len(t)]    
-    for wtIdx, text in enumerate(texts):
-        worktext = text
-        for char in CHARS_TO_IGNORE:
-            worktext = worktext.replace(char, "")
-            
-        # Drop redundant whitespace so as to not throw off word index
-        worktext = ' '.join(worktext.split())
-        words = worktext.split(" ")
-
-        for idx, word in enumerate(words):
-            
-            # Is this about another a system's gate?
-            if len(words) > idx + 1:
-                if words[idx+1].upper() == 'GATE':
-                    bailout = True
-                    if len(words) > idx + 2:
-                        if words[idx+2].upper() == 'TO':
-                            # Could be '___ GATE TO somewhere' so check this one.
-                            bailout = False
-                    if bailout:
-                        # '_____ GATE' mentioned in message, which is not what we're
-                        # interested in, so go to checking next word.
-                        continue
-            
-            upperWord = word.upper()
-            if upperWord != word and upperWord in WORDS_TO_IGNORE: continue
-            if upperWord in systemNames:  # - direct hit on name
-                foundSystems.add(systems[upperWord])  # of the system?
-                formattedText = formatSystem(text, word, upperWord)
-                textReplace(text, formattedText)
-                return True
-            elif 1 < len(upperWord) < 5:  # - upperWord < 4 chars.
-                for system in systemNames:  # system begins with?
-                    if system.startswith(upperWord):
-                        foundSystems.add(systems[system])
-                        formattedText = formatSystem(text, word, system)
-                        textReplace(text, formattedText)
-                        return True
-            elif "-" in upperWord and len(upperWord) > 2:  # - short with - (minus)
-                upperWordParts = upperWord.split("-")  # (I-I will match I43-IF3)
-                for system in systemNames:
-                    systemParts = system.split("-")
-                    if (len(upperWordParts) == 2 and len(systemParts) == 2 and len(upperWordParts[0]) > 1 and len(
-                            upperWordParts[1]) > 1 and len(systemParts[0]) > 1 and len(systemParts[1]) > 1 and len(
-                            upperWordParts) == len(systemParts) and upperWordParts[0][0] == systemParts[0][0] and
-                                upperWordParts[1][0] == systemParts[1][0]):
-                        foundSystems.add(systems[system])
-                        formattedText = formatSystem(text, word, system)
-                        textReplace(text, formattedText)
-                        return True
-            elif len(upperWord) > 1:  # what if F-YH58 is named FY?
-                for system in systemNames:
-                    clearedSystem = system.replace("-", "")
-                    if clearedSystem.startswith(upperWord):
-                        foundSystems.add(systems[system])
-                        formattedText = formatSystem(text, word, system)
-                        textReplace(text, formattedText)
-                        return True
-                        
+    texts = [t for t in rtext.contents if isinstance(t, NavigableString) and len(t)]
+    for text in texts:
+        hit = findSystem(systems, text, systemNameIndex)
+        if hit:
+            word, system = hit
+            foundSystems.add(systems[system])
+            formattedText = formatSystem(text, word, system)
+            textReplace(text, formattedText)
+            return True
+
     return False
 
 
-def parseUrls(rtext):
-    def findUrls(s):
-        # yes, this is faster than regex and less complex to read
-        urls = []
-        prefixes = ("http://", "https://")
-        for prefix in prefixes:
-            start = 0
-            while start >= 0:
-                start = s.find(prefix, start)
-                if start >= 0:
-                    stop = s.find(" ", start)
-                    if stop < 0:
-                        stop = len(s)
-                    urls.append(s[start:stop])
-                    start += 1
-        return urls
+def findUrls(s):
+    # yes, this is faster than regex and less complex to read
+    urls = []
+    prefixes = ("http://", "https://")
+    for prefix in prefixes:
+        start = 0
+        while start >= 0:
+            start = s.find(prefix, start)
+            if start >= 0:
+                stop = s.find(" ", start)
+                if stop < 0:
+                    stop = len(s)
+                urls.append(s[start:stop])
+                start += 1
+    return urls
 
+
+def parseUrls(rtext):
     def formatUrl(text, url):
         newText = u"""<a style="color:#28a5ed;font-weight:bold" href="link/{0}">{0}</a>"""
         text = text.replace(url, newText.format(url))
@@ -0,0 +1,97 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" Finds all the ship names in a text in one pass (Aho-Corasick automaton),
+    instead of searching the text for every single ship name.
+"""
+
+from collections import deque
+
+import vi.evegate as evegate
+
+
+class ShipMatcher(object):
+
+    def __init__(self, shipNames):
+        """ shipNames = the names in UPPER CASE, the first name has the
+            highest priority if more than one name is in a text
+        """
+        self.shipNames = list(shipNames)
+        self._goto = [{}]  # state: {char: next state}
+        self._fail = [0]
+        self._output = [[]]  # state: indices of the names ending here
+        for index, name in enumerate(self.shipNames):
+            state = 0
+            for char in name:
+                nextState = self._goto[state].get(char)
+                if nextState is None:
+                    nextState = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = nextState
+                state = nextState
+            self._output[state].append(index)
+        # breadth first, so the fail state of a state is always done before
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nextState in self._goto[state].items():
+                queue.append(nextState)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nextState] = self._goto[fail].get(char, 0)
+                self._output[nextState] = self._output[nextState] + self._output[self._fail[nextState]]
+
+    def firstOccurrences(self, upperText):
+        """ Returns a dict index of the name: start of its first occurrence
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        shipNames = self.shipNames
+        occurrences = {}
+        state = 0
+        for position, char in enumerate(upperText):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                if index not in occurrences:
+                    occurrences[index] = position + 1 - len(shipNames[index])
+        return occurrences
+
+    def find(self, text):
+        """ Returns start and end of the first ship name in text which is
+            not part of another word, or None if there is none.
+            Like searching the names one after another, only the first
+            occurrence of a name is checked.
+        """
+        upperText = text.upper()
+        occurrences = self.firstOccurrences(upperText)
+        for index in sorted(occurrences):
+            start = occurrences[index]
+            end = start + len(self.shipNames[index])
+            if ((start > 0 and upperText[start - 1] not in (" ", "X")) or (
+                    end < len(upperText) - 1 and upperText[end] not in ("S", " "))):
+                continue
+            return start, end
+        return None
+
+
+SHIP_MATCHER = ShipMatcher(evegate.SHIPNAMES)
@@ -0,0 +1,155 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" The functions in parser_functions work on a BeautifulSoup tree of the
+    line and every hit is parsed into a new part of the tree. That is a
+    lot of html parsing for a single line.
+    Here the line is split once into a list of segments, which are either
+    plain text or html we have rendered for a ship, url or system. The
+    segments are searched with the same rules (the find* functions of
+    parser_functions), a hit splits a text segment exactly the way
+    textReplace splits the text node. So the result is the same html
+    BeautifulSoup would give us, only without building any tree.
+    A line with something html-like in it ("<", "&" or an url with a quote)
+    still goes through BeautifulSoup, only the html parser knows what it
+    makes out of it.
+"""
+
+import six
+
+from bs4 import BeautifulSoup
+from vi.dotlan import SystemNameIndex
+
+from .parser_functions import findShip, findSystem, findUrls, statusOfTexts
+from .parser_functions import parseShips, parseStatus, parseSystems, parseUrls
+
+
+def _renderTemplate(html):
+    """ Lets BeautifulSoup render the tag once, so our html is exactly what
+        it would render (attribute order and quotes depend on its version)
+    """
+    return six.text_type(BeautifulSoup(html, 'html.parser'))
+
+
+SHIP_TEMPLATE = _renderTemplate(u"""<span style="color:#d95911;font-weight:bold"> {0}</span>""")
+URL_TEMPLATE = _renderTemplate(u"""<a style="color:#28a5ed;font-weight:bold" href="link/{0}">{0}</a>""")
+SYSTEM_TEMPLATE = _renderTemplate(u"""<a style="color:#CC8800;font-weight:bold" href="mark_system/{0}">{1}</a>""")
+
+
+def escape(text):
+    return text.replace(u"&", u"&amp;").replace(u"<", u"&lt;").replace(u">", u"&gt;")
+
+
+def _textSegment(text):
+    """ BeautifulSoup keeps a text which is only whitespace as a single
+        space (or newline), so we do the same
+    """
+    if not text.strip():
+        text = u"\n" if u"\n" in text else u" "
+    return (True, text)
+
+
+def _replace(text, word, html):
+    """ The segments text.replace(word, html) would be parsed into
+    """
+    segments = []
+    parts = text.split(word)
+    for index, part in enumerate(parts):
+        if part:
+            segments.append(_textSegment(part))
+        if index < len(parts) - 1:
+            segments.append((False, html))
+    return segments
+
+
+def _parseShips(segments):
+    index = 0
+    while index < len(segments):
+        isText, text = segments[index]
+        if isText:
+            hit = findShip(text)
+            if hit:
+                shipInText = text[hit[0]:hit[1]]
+                segments[index:index + 1] = _replace(text, shipInText, SHIP_TEMPLATE.format(escape(shipInText)))
+                # the new segments are searched again
+                continue
+        index += 1
+
+
+def _parseUrls(segments):
+    index = 0
+    while index < len(segments):
+        isText, text = segments[index]
+        if isText:
+            urls = findUrls(text)
+            if urls:
+                url = urls[0]
+                segments[index:index + 1] = _replace(text, url, URL_TEMPLATE.format(escape(url)))
+                continue
+        index += 1
+
+
+def _parseSystems(systems, systemNameIndex, segments, foundSystems):
+    index = 0
+    while index < len(segments):
+        isText, text = segments[index]
+        if isText and text:
+            hit = findSystem(systems, text, systemNameIndex)
+            if hit:
+                word, system = hit
+                foundSystems.add(systems[system])
+                # if word was only found after removing CHARS_TO_IGNORE
+                # there is nothing to replace, so we go on with the next
+                if word in text:
+                    segments[index:index + 1] = _replace(text, word, SYSTEM_TEMPLATE.format(system, escape(word)))
+                    continue
+        index += 1
+
+
+def _parseWithSoup(systems, systemNameIndex, text, foundSystems):
+    formatedText = u"<rtext>{0}</rtext>".format(text)
+    soup = BeautifulSoup(formatedText, 'html.parser')
+    rtext = soup.select("rtext")[0]
+    while parseShips(rtext):
+        continue
+    while parseUrls(rtext):
+        continue
+    while parseSystems(systems, rtext, foundSystems, systemNameIndex):
+        continue
+    return six.text_type(rtext), parseStatus(rtext)
+
+
+def parseLine(systems, text, systemNameIndex=None):
+    """ Finds ships, urls and systems in the text of a chat line.
+        Returns the html of the text with them marked, the set of systems
+        mentioned and the status of the message (None if there is none)
+    """
+    if systemNameIndex is None:
+        systemNameIndex = SystemNameIndex(systems)
+    foundSystems = set()
+    if u"<" in text or u"&" in text or any(u'"' in url for url in findUrls(text)):
+        html, status = _parseWithSoup(systems, systemNameIndex, text, foundSystems)
+        return html, foundSystems, status
+    segments = [_textSegment(text)] if text else []
+    _parseShips(segments)
+    _parseUrls(segments)
+    _parseSystems(systems, systemNameIndex, segments, foundSystems)
+    status = statusOfTexts([text for isText, text in segments if isText])
+    html = u"".join(escape(content) if isText else content for isText, content in segments)
+    return u"<rtext>{0}</rtext>".format(html), foundSystems, status
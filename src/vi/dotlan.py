@@ -21,15 +21,17 @@
 # Little lib and tool to get the map and information from dotlan		  #
 ###########################################################################
 
+import json
 import math
+import hashlib
 import time
 import six
 import requests
 import logging
 
-from bs4 import BeautifulSoup
 from vi import states
 from vi.cache.cache import Cache
+from vi.mapdocument import createDocument, loadDocument
 
 from . import evegate
 
@@ -38,11 +40,75 @@ JB_COLORS = ("800000", "808000", "BC8F8F", "ff00ff", "c83737", "FF6347", "917c6f
              "CD5C5C", "FFD700", "66CDAA", "AFEEEE", "5F9EA0", "FFDEAD", "696969", "2F4F4F")
 
 
+# bump it if Map prepares the svg in another way, so the bundles are built again
+MAP_BUNDLE_VERSION = 2
+MAP_BUNDLE_MAX_AGE = 60 * 60 * 24 * 30
+
+
 class DotlanException(Exception):
     def __init__(self, *args, **kwargs):
         Exception.__init__(self, *args, **kwargs)
 
 
+class SystemNameIndex(object):
+    """
+        Index of the system names for the chat parser. A word which may be
+        an abbreviation of a system is looked up in time of the word length
+        and not by walking through all the systems.
+        If a word fits more than one system, the system which comes first
+        in the systems dict is returned, like a loop over the dict would do.
+    """
+
+    def __init__(self, systems):
+        self.names = set(systems.keys())
+        self._prefixTrie = {}  # abbreviations: HED for HED-GP
+        self._strippedTrie = {}  # names without "-": FY for F-YH58
+        self._dashedInitials = {}  # (first letter, first letter after "-"): I-I for I43-IF3
+        for name in systems.keys():
+            self._insert(self._prefixTrie, name)
+            self._insert(self._strippedTrie, name.replace("-", ""), name)
+            parts = name.split("-")
+            if len(parts) == 2 and len(parts[0]) > 1 and len(parts[1]) > 1:
+                self._dashedInitials.setdefault((parts[0][0], parts[1][0]), name)
+
+    @staticmethod
+    def _insert(trie, key, name=None):
+        # every node remembers the first name below it (key "" is never a char)
+        name = name or key
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+            node.setdefault("", name)
+
+    @staticmethod
+    def _lookup(trie, prefix):
+        node = trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return None
+        return node.get("")
+
+    def startingWith(self, prefix):
+        """ The first system whose name starts with prefix
+        """
+        return self._lookup(self._prefixTrie, prefix)
+
+    def strippedStartingWith(self, prefix):
+        """ The first system whose name without "-" starts with prefix
+        """
+        return self._lookup(self._strippedTrie, prefix)
+
+    def matchingDashed(self, word):
+        """ The first system with the same first letters before and after
+            the "-" as word (I-I will match I43-IF3)
+        """
+        parts = word.split("-")
+        if len(parts) == 2 and len(parts[0]) > 1 and len(parts[1]) > 1:
+            return self._dashedInitials.get((parts[0][0], parts[1][0]))
+        return None
+
+
 class Map(object):
     """
         The map including all information from dotlan
@@ -50,20 +116,134 @@ class Map(object):
 
     DOTLAN_BASIC_URL = u"http://evemaps.dotlan.net/svg/{0}.svg"
 
+    # Applies the changes (see changesScript) to the loaded document
+    PATCH_SCRIPT = u"""(function (changes) {
+    changes.removed.forEach(function (id) {
+        var element = document.getElementById(id);
+        if (element) element.parentNode.removeChild(element);
+    });
+    changes.changed.forEach(function (change) {
+        var id = change[0], name = change[1], attributes = change[2], text = change[3];
+        var element = document.getElementById(id);
+        if (!element) {
+            element = document.createElementNS("http://www.w3.org/2000/svg", name);
+            var jumps = document.getElementById("jumps");
+            jumps.insertBefore(element, jumps.firstChild);
+        }
+        for (var i = element.attributes.length - 1; i >= 0; i--) {
+            if (!(element.attributes[i].name in attributes)) element.removeAttribute(element.attributes[i].name);
+        }
+        for (var attribute in attributes) element.setAttribute(attribute, attributes[attribute]);
+        if (text !== null) element.textContent = text;
+    });
+})({0});"""
+
     @property
     def svg(self):
+        generation = self.update()
+        if generation != self._svgGeneration:
+            self._svgContent = self._serializeSvg()
+            self._svgGeneration = generation
+        if generation != self._renderedGeneration:
+            self._renderedStates = dict((system, system.elementStates()) for system in self.systems.values())
+            self._renderedMarkerState = self.document.state(self.marker)
+            self._renderedGeneration = generation
+        return self._svgContent
+
+    def _splitSvg(self):
+        """ Renders the document once into the static chunks between the
+            parts which can change: the marker, the elements inserted at the
+            beginning of #jumps (location ellipses and jumpbridges) and the
+            svg element and statistics text of every system.
+        """
+        jumps = self.document.byId("jumps")
+        fragments = [(self.marker, None), ((jumps, self._jumpsFirstChild), None)]
+        for system in self.systems.values():
+            fragments.append((system.svgElement, system))
+            if system.statisticsElement is not None:
+                fragments.append((system.statisticsElement, system))
+        # static chunks and fragment numbers take turns
+        self._svgParts = self.document.renderParts([fragment for fragment, system in fragments])
+        self._svgFragments = []
+        for index in range(1, len(self._svgParts), 2):
+            fragment, system = fragments[int(self._svgParts[index])]
+            self._svgFragments.append((index, fragment, system))
+        self._fragmentGenerations = {}
+
+    def _serializeSvg(self):
+        """ The same as rendering the whole document, but only the fragments
+            which changed are rendered again
+        """
+        if self._svgParts is None:
+            self._splitSvg()
+        parts = self._svgParts
+        for index, fragment, system in self._svgFragments:
+            if system is None:
+                parts[index] = self.document.renderFragment(fragment)
+            elif self._fragmentGenerations.get(index) != system.changeGeneration:
+                parts[index] = self.document.renderFragment(fragment)
+                self._fragmentGenerations[index] = system.changeGeneration
+        return "".join(parts)
+
+    def update(self):
+        """ Brings the systems (stopwatches, alarm colors) and the marker up
+            to date. Returns the change generation of the map, which is
+            incremented whenever something on the map changed. So the map
+            needs no new rendering as long as it stays the same.
+        """
         # Re-render all systems
         for system in self.systems.values():
             system.update()
         # Update the marker
-        if not self.marker["opacity"] == "0":
+        document = self.document
+        if not document.get(self.marker, "opacity") == "0":
             now = time.time()
-            newValue = (1 - (now - float(self.marker["activated"])) / 10)
+            newValue = (1 - (now - float(document.get(self.marker, "activated"))) / 10)
             if newValue < 0:
                 newValue = "0"
-            self.marker["opacity"] = newValue
-        content = str(self.soup)
-        return content
+            document.set(self.marker, "opacity", newValue)
+        markerState = tuple(document.get(self.marker, name) for name in ("transform", "opacity", "activated"))
+        dirtySystems = [system for system in self.systems.values() if system.dirty]
+        if dirtySystems or self._changed or markerState != self._markerState:
+            self.generation += 1
+            for system in dirtySystems:
+                system.dirty = False
+                system.changeGeneration = self.generation
+            self._changed = False
+            self._markerState = markerState
+        return self.generation
+
+    def changesScript(self):
+        """ JavaScript which applies all changes since the last svg (or
+            changesScript) to the document loaded from that svg. An empty
+            string if nothing changed, None if the document must be loaded
+            again from svg (f.e. the jumpbridges changed).
+        """
+        if self._renderedGeneration is None:
+            return None
+        generation = self.update()
+        if generation == self._renderedGeneration:
+            return u""
+        changed = []
+        removed = []
+        for system in self.systems.values():
+            if system.changeGeneration <= self._renderedGeneration:
+                continue
+            states = system.elementStates()
+            renderedStates = self._renderedStates[system]
+            changed.extend([elementId] + list(state) for elementId, state in states.items()
+                           if renderedStates.get(elementId) != state)
+            removed.extend(elementId for elementId in renderedStates if elementId not in states)
+            self._renderedStates[system] = states
+        markerState = self.document.state(self.marker)
+        if markerState != self._renderedMarkerState:
+            changed.append(["select_marker"] + list(markerState))
+            self._renderedMarkerState = markerState
+        self._renderedGeneration = generation
+        if not changed and not removed:
+            return u""
+        changes = {"changed": changed, "removed": removed}
+        return self.PATCH_SCRIPT.replace(u"{0}", json.dumps(changes))
 
     def __init__(self, region, svgFile=None):
         self.region = region
@@ -90,91 +270,179 @@ class Map(object):
                         "without the map.\n\nRemember the site for possible " \
                         "updates: https://github.com/Xanthos-Eve/vintel".format(type(e), six.text_type(e))
                     raise DotlanException(t)
-        # Create soup from the svg
-        self.soup = BeautifulSoup(svg, 'html.parser')
-        self.systems = self._extractSystemsFromSoup(self.soup)
-        self.systemsById = {}
-        for system in self.systems.values():
-            self.systemsById[system.systemId] = system
-        self._prepareSvg(self.soup, self.systems)
-        self._connectNeighbours()
+        # Create the document from the svg, prepared in a bundle before
+        bundleKey = "map_bundle_" + self.region
+        sourceHash = hashlib.sha1(svg.encode("utf-8") if isinstance(svg, six.text_type) else svg).hexdigest()
+        if not self._loadBundle(cache.getFromCache(bundleKey), sourceHash):
+            self.document = createDocument(svg)
+            self.systems = self._extractSystems()
+            self.systemsById = {}
+            for system in self.systems.values():
+                self.systemsById[system.systemId] = system
+            self._prepareSvg()
+            self._connectNeighbours()
+            cache.putIntoCache(bundleKey, self._bundle(sourceHash), MAP_BUNDLE_MAX_AGE)
+        self.systemNameIndex = SystemNameIndex(self.systems)
         self._jumpMapsVisible = False
         self._statisticsVisible = False
-        self.marker = self.soup.select("#select_marker")[0]
-
-    def _extractSystemsFromSoup(self, soup):
+        self.marker = self.document.byId("select_marker")
+        # incremented by update for every change on the map
+        self.generation = 0
+        self._changed = False  # changes which belong to no system (jumpbridges)
+        self._markerState = None
+        self._svgContent = None
+        self._svgGeneration = None
+        # the static chunks and changing fragments of the svg (_splitSvg)
+        self._jumpsFirstChild = self.document.firstChild(self.document.byId("jumps"))
+        self._svgParts = None
+        self._svgFragments = None
+        self._fragmentGenerations = None
+        # the generation and the states of the changing elements of the
+        # document loaded from svg, None if it must be loaded again
+        self._renderedGeneration = None
+        self._renderedStates = {}
+        self._renderedMarkerState = None
+
+    def _bundle(self, sourceHash):
+        """ The prepared map as json: the document (see MapDocument.dump),
+            the systems (where they are in the svg and on the map) and the
+            neighbours, so the next Map of the svg (the sha1 sourceHash) needs
+            not to parse, search and prepare it again
+        """
+        document = self.document
+        systems = []
+        for system in self.systems.values():
+            symbol = document.parent(system.svgElement)
+            while document.name(symbol) != "symbol":
+                symbol = document.parent(symbol)
+            index = [element is system.svgElement for element in document.withClass(symbol, "sys")].index(True)
+            coords = system.mapCoordinates
+            systems.append([document.get(symbol, "id"), index, system.name, system.systemId, coords["x"], coords["y"],
+                            coords["width"], coords["height"], system.transform])
+        neighbours = []
+        for system in self.systemsById.values():
+            for neighbour in system._neighbours:
+                if system.systemId < neighbour.systemId:
+                    neighbours.append([system.systemId, neighbour.systemId])
+        bundle = {"version": MAP_BUNDLE_VERSION, "source": sourceHash, "backend": document.BACKEND,
+                  "document": document.dump(), "systems": systems, "neighbours": neighbours}
+        return json.dumps(bundle)
+
+    def _loadBundle(self, content, sourceHash):
+        """ Creates document and systems from the bundle (see _bundle).
+            False if there is no usable bundle for the svg, the map must be
+            prepared from the svg then. Without lxml the document is built
+            from the tree in the bundle, with lxml from xml, so no html is
+            parsed
+        """
+        if not content:
+            return False
+        try:
+            bundle = json.loads(content)
+            if bundle["version"] != MAP_BUNDLE_VERSION or bundle["source"] != sourceHash:
+                return False
+            document = loadDocument(bundle["backend"], bundle["document"])
+            systems = {}
+            systemsById = {}
+            for symbolId, index, name, systemId, x, y, width, height, transform in bundle["systems"]:
+                element = document.withClass(document.byId(symbolId), "sys")[index]
+                mapCoordinates = {"x": x, "y": y, "width": width, "height": height,
+                                  "center_x": x + width / 2, "center_y": y + height / 2}
+                system = System(name, element, document, mapCoordinates, transform, systemId)
+                systems[name] = system
+                systemsById[systemId] = system
+            for system in systemsById.values():
+                system.statisticsElement = document.byId("stats_" + str(system.systemId))
+            for startId, stopId in bundle["neighbours"]:
+                systemsById[startId].addNeighbour(systemsById[stopId])
+        except Exception as e:
+            # any bundle we can not use is as good as none
+            logging.error("Map bundle of %s broken: %s", self.region, e)
+            return False
+        self.document = document
+        self.systems = systems
+        self.systemsById = systemsById
+        return True
+
+    def _extractSystems(self):
+        document = self.document
         systems = {}
         uses = {}
-        for use in soup.select("use"):
-            useId = use["xlink:href"][1:]
+        for use in document.findAll(document.root, "use"):
+            useId = document.get(use, "xlink:href")[1:]
             uses[useId] = use
-        symbols = soup.select("symbol")
+        symbols = document.findAll(document.root, "symbol")
         for symbol in symbols:
-            symbolId = symbol["id"]
+            symbolId = document.get(symbol, "id")
             systemId = symbolId[3:]
             try:
                 systemId = int(systemId)
             except ValueError as e:
                 continue
-            for element in symbol.select(".sys"):
-                name = element.select("text")[0].text.strip().upper()
+            for element in document.withClass(symbol, "sys"):
+                name = document.allText(document.findAll(element, "text")[0]).strip().upper()
                 mapCoordinates = {}
                 for keyname in ("x", "y", "width", "height"):
-                    mapCoordinates[keyname] = float(uses[symbolId][keyname])
+                    mapCoordinates[keyname] = float(document.get(uses[symbolId], keyname))
                 mapCoordinates["center_x"] = (mapCoordinates["x"] + (mapCoordinates["width"] / 2))
                 mapCoordinates["center_y"] = (mapCoordinates["y"] + (mapCoordinates["height"] / 2))
-                try:
-                    transform = uses[symbolId]["transform"]
-                except KeyError:
-                    transform = "translate(0,0)"
-                systems[name] = System(name, element, self.soup, mapCoordinates, transform, systemId)
+                transform = document.get(uses[symbolId], "transform", "translate(0,0)")
+                systems[name] = System(name, element, document, mapCoordinates, transform, systemId)
         return systems
 
-    def _prepareSvg(self, soup, systems):
-        svg = soup.select("svg")[0]
+    def _prepareSvg(self):
+        document = self.document
+        svg = document.root
         # Disable dotlan mouse functionality and make all jump lines black
-        svg["onmousedown"] = "return false;"
-        for line in soup.select("line"):
-            line["class"] = "j"
+        document.set(svg, "onmousedown", "return false;")
+        for line in document.findAll(svg, "line"):
+            document.set(line, "class", "j")
 
         # Current system marker ellipse
-        group = soup.new_tag("g", id="select_marker", opacity="0", activated="0", transform="translate(0, 0)")
-        ellipse = soup.new_tag("ellipse", cx="0", cy="0", rx="56", ry="28", style="fill:#462CFF")
-        group.append(ellipse)
+        group = document.createElement("g", {"id": "select_marker", "opacity": "0", "activated": "0",
+                                             "transform": "translate(0, 0)"})
+        ellipse = document.createElement("ellipse", {"cx": "0", "cy": "0", "rx": "56", "ry": "28",
+                                                     "style": "fill:#462CFF"})
+        document.append(group, ellipse)
 
         # The giant cross-hairs
         for coord in ((0, -10000), (-10000, 0), (10000, 0), (0, 10000)):
-            line = soup.new_tag("line", x1=coord[0], y1=coord[1], x2="0", y2="0", style="stroke:#462CFF")
-            group.append(line)
-        svg.insert(0, group)
+            line = document.createElement("line", {"x1": coord[0], "y1": coord[1], "x2": "0", "y2": "0",
+                                                   "style": "stroke:#462CFF"})
+            document.append(group, line)
+        document.insert(svg, 0, group)
 
         # Create jumpbridge markers in a variety of colors
         for jbColor in JB_COLORS:
-            startPath = soup.new_tag("path", d="M 10 0 L 10 10 L 0 5 z")
-            startMarker = soup.new_tag("marker", viewBox="0 0 20 20", id="arrowstart_{0}".format(jbColor),
-                                       markerUnits="strokeWidth", markerWidth="20", markerHeight="15", refx="-15",
-                                       refy="5", orient="auto", style="stroke:#{0};fill:#{0}".format(jbColor))
-            startMarker.append(startPath)
-            svg.insert(0, startMarker)
-            endpath = soup.new_tag("path", d="M 0 0 L 10 5 L 0 10 z")
-            endmarker = soup.new_tag("marker", viewBox="0 0 20 20", id="arrowend_{0}".format(jbColor),
-                                     markerUnits="strokeWidth", markerWidth="20", markerHeight="15", refx="25",
-                                     refy="5", orient="auto", style="stroke:#{0};fill:#{0}".format(jbColor))
-            endmarker.append(endpath)
-            svg.insert(0, endmarker)
-        jumps = soup.select("#jumps")[0]
+            startPath = document.createElement("path", {"d": "M 10 0 L 10 10 L 0 5 z"})
+            startMarker = document.createElement("marker", {"viewBox": "0 0 20 20", "id": "arrowstart_{0}".format(jbColor),
+                                                            "markerUnits": "strokeWidth", "markerWidth": "20",
+                                                            "markerHeight": "15", "refx": "-15", "refy": "5",
+                                                            "orient": "auto",
+                                                            "style": "stroke:#{0};fill:#{0}".format(jbColor)})
+            document.append(startMarker, startPath)
+            document.insert(svg, 0, startMarker)
+            endpath = document.createElement("path", {"d": "M 0 0 L 10 5 L 0 10 z"})
+            endmarker = document.createElement("marker", {"viewBox": "0 0 20 20", "id": "arrowend_{0}".format(jbColor),
+                                                          "markerUnits": "strokeWidth", "markerWidth": "20",
+                                                          "markerHeight": "15", "refx": "25", "refy": "5",
+                                                          "orient": "auto",
+                                                          "style": "stroke:#{0};fill:#{0}".format(jbColor)})
+            document.append(endmarker, endpath)
+            document.insert(svg, 0, endmarker)
+        jumps = document.byId("jumps")
 
         # Set up the tags for system statistics
         for systemId, system in self.systemsById.items():
             coords = system.mapCoordinates
-            text = "stats n/a"
             style = "text-anchor:middle;font-size:8;font-weight:normal;font-family:Arial;"
-            svgtext = soup.new_tag("text", x=coords["center_x"], y=coords["y"] + coords["height"] + 6, fill="blue",
-                                   style=style, visibility="hidden", transform=system.transform)
-            svgtext["id"] = "stats_" + str(systemId)
-            svgtext["class"] = ["statistics", ]
-            svgtext.string = text
-            jumps.append(svgtext)
+            svgtext = document.createElement("text", {"x": coords["center_x"], "y": coords["y"] + coords["height"] + 6,
+                                                      "fill": "blue", "style": style, "visibility": "hidden",
+                                                      "transform": system.transform, "id": "stats_" + str(systemId),
+                                                      "class": "statistics"})
+            document.setText(svgtext, "stats n/a")
+            document.append(jumps, svgtext)
+            system.statisticsElement = svgtext
 
     def _connectNeighbours(self):
         """
@@ -182,9 +450,10 @@ class Map(object):
             It takes a look at all the jumps on the map and gets the system under
             which the line ends
         """
-        for jump in self.soup.select("#jumps")[0].select(".j"):
-            if "jumpbridge" in jump["class"]: continue
-            parts = jump["id"].split("-")
+        document = self.document
+        for jump in document.withClass(document.byId("jumps"), "j"):
+            if "jumpbridge" in document.classes(jump): continue
+            parts = document.get(jump, "id").split("-")
             if parts[0] == "j":
                 startSystem = self.systemsById[int(parts[1])]
                 stopSystem = self.systemsById[int(parts[2])]
@@ -209,13 +478,16 @@ class Map(object):
 
     def setJumpbridges(self, jumpbridgesData):
         """
-            Adding the jumpbridges to the map soup; format of data:
+            Adding the jumpbridges to the map document; format of data:
             tuples with 3 values (sys1, connection, sys2)
         """
-        soup = self.soup
-        for bridge in soup.select(".jumpbridge"):
-            bridge.decompose()
-        jumps = soup.select("#jumps")[0]
+        document = self.document
+        # the jumpbridges have no ids, so the document must be loaded again
+        self._renderedGeneration = None
+        self._changed = True
+        for bridge in document.withClass(document.root, "jumpbridge"):
+            document.remove(bridge)
+        jumps = document.byId("jumps")
         colorCount = 0
 
         for bridge in jumpbridgesData:
@@ -240,38 +512,42 @@ class Map(object):
             systemTwo.setJumpbridgeColor(jbColor)
 
             # Construct the line, color it and add it to the jumps
-            line = soup.new_tag("line", x1=systemOneCoords["center_x"] + systemOneOffsetPoint[0],
-                                y1=systemOneCoords["center_y"] + systemOneOffsetPoint[1],
-                                x2=systemTwoCoords["center_x"] + systemTwoOffsetPoint[0],
-                                y2=systemTwoCoords["center_y"] + systemTwoOffsetPoint[1], visibility="hidden",
-                                style="stroke:#{0}".format(jbColor))
-            line["stroke-width"] = 2
-            line["class"] = ["jumpbridge", ]
+            attributes = {"x1": systemOneCoords["center_x"] + systemOneOffsetPoint[0],
+                          "y1": systemOneCoords["center_y"] + systemOneOffsetPoint[1],
+                          "x2": systemTwoCoords["center_x"] + systemTwoOffsetPoint[0],
+                          "y2": systemTwoCoords["center_y"] + systemTwoOffsetPoint[1], "visibility": "hidden",
+                          "style": "stroke:#{0}".format(jbColor), "stroke-width": 2, "class": "jumpbridge"}
             if "<" in connection:
-                line["marker-start"] = "url(#arrowstart_{0})".format(jbColor)
+                attributes["marker-start"] = "url(#arrowstart_{0})".format(jbColor)
             if ">" in connection:
-                line["marker-end"] = "url(#arrowend_{0})".format(jbColor)
-            jumps.insert(0, line)
+                attributes["marker-end"] = "url(#arrowend_{0})".format(jbColor)
+            document.insert(jumps, 0, document.createElement("line", attributes))
 
     def changeStatisticsVisibility(self):
         newStatus = False if self._statisticsVisible else True
         value = "visible" if newStatus else "hidden"
-        for line in self.soup.select(".statistics"):
-            line["visibility"] = value
+        for system in self.systems.values():
+            if system.statisticsElement is not None:
+                self.document.set(system.statisticsElement, "visibility", value)
+            system.dirty = True
         self._statisticsVisible = newStatus
         return newStatus
 
     def changeJumpbridgesVisibility(self):
         newStatus = False if self._jumpMapsVisible else True
         value = "visible" if newStatus else "hidden"
-        for line in self.soup.select(".jumpbridge"):
-            line["visibility"] = value
+        for line in self.document.withClass(self.document.root, "jumpbridge"):
+            self.document.set(line, "visibility", value)
         self._jumpMapsVisible = newStatus
+        self._renderedGeneration = None
+        self._changed = True
         # self.debugWriteSoup()
         return newStatus
 
     def debugWriteSoup(self):
-        svgData = self.soup.prettify("utf-8")
+        svgData = self.document.render()
+        if isinstance(svgData, six.text_type):
+            svgData = svgData.encode("utf-8")
         try:
             with open("/Users/mark/Desktop/output.svg", "wb") as svgFile:
                 svgFile.write(svgData)
@@ -291,14 +567,27 @@ class System(object):
     UNKNOWN_COLOR = "#FFFFFF"
     CLEAR_COLOR = "#59FF6C"
 
-    def __init__(self, name, svgElement, mapSoup, mapCoordinates, transform, systemId):
+    def __init__(self, name, svgElement, document, mapCoordinates, transform, systemId):
         self.status = states.UNKNOWN
         self.name = name
         self.svgElement = svgElement
-        self.mapSoup = mapSoup
+        self.document = document
         self.origSvgElement = svgElement
-        self.rect = svgElement.select("rect")[0]
-        self.secondLine = svgElement.select("text")[1]
+        self.rects = document.findAll(svgElement, "rect")
+        self.rect = self.rects[0]
+        self.secondLine = document.findAll(svgElement, "text")[1]
+        # the changing elements need ids to be found in the loaded document
+        for index, rect in enumerate(self.rects):
+            if not document.get(rect, "id"):
+                document.set(rect, "id", u"rect{0}_{1}".format(systemId, index))
+        if not document.get(self.secondLine, "id"):
+            document.set(self.secondLine, "id", u"txt{0}".format(systemId))
+        self.statisticsElement = None
+        self.locationElement = None
+        # set by every change of the elements, Map.update resets it
+        self.dirty = True
+        # the Map.generation of the last change
+        self.changeGeneration = 0
         self.lastAlarmTime = 0
         self.messages = []
         self.setStatus(states.UNKNOWN)
@@ -322,27 +611,31 @@ class System(object):
         return self.cachedOffsetPoint
 
     def setJumpbridgeColor(self, color):
+        document = self.document
         idName = self.name + u"_jb_marker"
-        for element in self.mapSoup.select(u"#" + idName):
-            element.decompose()
+        element = document.byId(idName)
+        if element is not None:
+            document.remove(element)
         coords = self.mapCoordinates
         offsetPoint = self.getTransformOffsetPoint()
         x = coords["x"] - 3 + offsetPoint[0]
         y = coords["y"] + offsetPoint[1]
         style = "fill:{0};stroke:{0};stroke-width:2;fill-opacity:0.4"
-        tag = self.mapSoup.new_tag("rect", x=x, y=y, width=coords["width"] + 1.5, height=coords["height"], id=idName, style=style.format(color), visibility="hidden")
-        tag["class"] = ["jumpbridge", ]
-        jumps = self.mapSoup.select("#jumps")[0]
-        jumps.insert(0, tag)
+        tag = document.createElement("rect", {"x": x, "y": y, "width": coords["width"] + 1.5, "height": coords["height"],
+                                              "id": idName, "style": style.format(color), "visibility": "hidden",
+                                              "class": "jumpbridge"})
+        document.insert(document.byId("jumps"), 0, tag)
+        self.dirty = True
 
     def mark(self):
-        marker = self.mapSoup.select("#select_marker")[0]
+        document = self.document
+        marker = document.byId("select_marker")
         offsetPoint = self.getTransformOffsetPoint()
         x = self.mapCoordinates["center_x"] + offsetPoint[0]
         y = self.mapCoordinates["center_y"] + offsetPoint[1]
-        marker["transform"] = "translate({x},{y})".format(x=x, y=y)
-        marker["opacity"] = "1"
-        marker["activated"] = time.time()
+        document.set(marker, "transform", "translate({x},{y})".format(x=x, y=y))
+        document.set(marker, "opacity", "1")
+        document.set(marker, "activated", time.time())
 
     def addLocatedCharacter(self, charname):
         idName = self.name + u"_loc"
@@ -351,16 +644,23 @@ class System(object):
             self.__locatedCharacters.append(charname)
         if not wasLocated:
             coords = self.mapCoordinates
-            newTag = self.mapSoup.new_tag("ellipse", cx=coords["center_x"] - 2.5, cy=coords["center_y"], id=idName,
-                    rx=coords["width"] / 2 + 4, ry=coords["height"] / 2 + 4, style="fill:#8b008d",
-                    transform=self.transform)
-            jumps = self.mapSoup.select("#jumps")[0]
-            jumps.insert(0, newTag)
+            newTag = self.document.createElement("ellipse", {"cx": coords["center_x"] - 2.5, "cy": coords["center_y"],
+                                                             "id": idName, "rx": coords["width"] / 2 + 4,
+                                                             "ry": coords["height"] / 2 + 4, "style": "fill:#8b008d",
+                                                             "transform": self.transform})
+            self.document.insert(self.document.byId("jumps"), 0, newTag)
+            self.locationElement = newTag
+            self.dirty = True
 
     def setBackgroundColor(self, color):
-        for rect in self.svgElement("rect"):
-            if "location" not in rect.get("class", []) and "marked" not in rect.get("class", []):
-                rect["style"] = "fill: {0};".format(color)
+        document = self.document
+        style = "fill: {0};".format(color)
+        for rect in self.rects:
+            classes = document.classes(rect)
+            if "location" not in classes and "marked" not in classes:
+                if document.get(rect, "style") != style:
+                    document.set(rect, "style", style)
+                    self.dirty = True
 
     def getLocatedCharacters(self):
         characters = []
@@ -369,13 +669,12 @@ class System(object):
         return characters
 
     def removeLocatedCharacter(self, charname):
-        idName = self.name + u"_loc"
-
         if charname in self.__locatedCharacters:
             self.__locatedCharacters.remove(charname)
-            if not self.__locatedCharacters:
-                for element in self.mapSoup.select("#" + idName):
-                    element.decompose()
+            if not self.__locatedCharacters and self.locationElement is not None:
+                self.document.remove(self.locationElement)
+                self.locationElement = None
+                self.dirty = True
 
     def addNeighbour(self, neighbourSystem):
         """
@@ -409,6 +708,15 @@ class System(object):
                 systems[newSystem] = {"distance": currentDistance}
         return systems
 
+    def elementStates(self):
+        """ The states of the elements of the system which can change, as
+            dict id: state
+        """
+        document = self.document
+        elements = self.rects + [self.secondLine, self.statisticsElement, self.locationElement]
+        return dict((document.get(element, "id"), document.state(element)) for element in elements
+                    if element is not None)
+
     def removeNeighbour(self, system):
         """
             Removes the link between to neighboured systems
@@ -418,31 +726,40 @@ class System(object):
         if self in system._neighbours:
             system._neigbours.remove(self)
 
-    def setStatus(self, newStatus):
+    def setStatus(self, newStatus, alarmTime=None):
+        """ alarmTime is the time (seconds since the epoch) of the alarm or
+            clear, if it was not now
+        """
+        if alarmTime is None:
+            alarmTime = time.time()
+        document = self.document
+        secondLine = self.secondLine
         if newStatus == states.ALARM:
-            self.lastAlarmTime = time.time()
-            if "stopwatch" not in self.secondLine["class"]:
-                self.secondLine["class"].append("stopwatch")
-            self.secondLine["alarmtime"] = self.lastAlarmTime
-            self.secondLine["style"] = "fill: #FFFFFF;"
+            self.lastAlarmTime = alarmTime
+            if "stopwatch" not in document.classes(secondLine):
+                document.addClass(secondLine, "stopwatch")
+            document.set(secondLine, "alarmtime", self.lastAlarmTime)
+            document.set(secondLine, "style", "fill: #FFFFFF;")
             self.setBackgroundColor(self.ALARM_COLOR)
         elif newStatus == states.CLEAR:
-            self.lastAlarmTime = time.time()
+            self.lastAlarmTime = alarmTime
             self.setBackgroundColor(self.CLEAR_COLOR)
-            self.secondLine["alarmtime"] = 0
-            if "stopwatch" not in self.secondLine["class"]:
-                self.secondLine["class"].append("stopwatch")
-            self.secondLine["alarmtime"] = self.lastAlarmTime
-            self.secondLine["style"] = "fill: #000000;"
-            self.secondLine.string = "clear"
+            document.set(secondLine, "alarmtime", 0)
+            if "stopwatch" not in document.classes(secondLine):
+                document.addClass(secondLine, "stopwatch")
+            document.set(secondLine, "alarmtime", self.lastAlarmTime)
+            document.set(secondLine, "style", "fill: #000000;")
+            document.setText(secondLine, "clear")
         elif newStatus == states.WAS_ALARMED:
             self.setBackgroundColor(self.UNKNOWN_COLOR)
-            self.secondLine["style"] = "fill: #000000;"
+            document.set(secondLine, "style", "fill: #000000;")
         elif newStatus == states.UNKNOWN:
             self.setBackgroundColor(self.UNKNOWN_COLOR)
             # second line in the rects is reserved for the clock
-            self.secondLine.string = "?"
-            self.secondLine["style"] = "fill: #000000;"
+            document.setText(secondLine, "?")
+            document.set(secondLine, "style", "fill: #000000;")
+        if newStatus in (states.ALARM, states.CLEAR, states.WAS_ALARMED, states.UNKNOWN):
+            self.dirty = True
         if newStatus not in (states.NOT_CHANGE, states.REQUEST):  # unknown not affect system status
             self.status = newStatus
 
@@ -451,10 +768,13 @@ class System(object):
             text = "stats n/a"
         else:
             text = "j-{jumps} f-{factionkills} s-{shipkills} p-{podkills}".format(**statistics)
-        svgtext = self.mapSoup.select("#stats_" + str(self.systemId))[0]
-        svgtext.string = text
+        svgtext = self.document.byId("stats_" + str(self.systemId))
+        if self.document.text(svgtext) != text:
+            self.document.setText(svgtext, text)
+            self.dirty = True
 
     def update(self):
+        document = self.document
         # state changed?
         if (self.status == states.ALARM):
             alarmTime = time.time() - self.lastAlarmTime
@@ -462,10 +782,12 @@ class System(object):
                 if alarmTime < maxDiff:
                     if self.backgroundColor != alarmColor:
                         self.backgroundColor = alarmColor
-                        for rect in self.svgElement("rect"):
-                            if "location" not in rect.get("class", []) and "marked" not in rect.get("class", []):
-                                rect["style"] = "fill: {0};".format(self.backgroundColor)
-                        self.secondLine["style"] = "fill: {0};".format(secondLineColor)
+                        for rect in self.rects:
+                            classes = document.classes(rect)
+                            if "location" not in classes and "marked" not in classes:
+                                document.set(rect, "style", "fill: {0};".format(self.backgroundColor))
+                        document.set(self.secondLine, "style", "fill: {0};".format(secondLineColor))
+                        self.dirty = True
                     break
         if self.status in (states.ALARM, states.WAS_ALARMED, states.CLEAR):  # timer
             diff = math.floor(time.time() - self.lastAlarmTime)
@@ -477,10 +799,14 @@ class System(object):
                 calcValue = int(diff / (secondsUntilWhite / 255.0))
                 if calcValue > 255:
                     calcValue = 255
-                    self.secondLine["style"] = "fill: #008100;"
+                    if document.get(self.secondLine, "style") != "fill: #008100;":
+                        document.set(self.secondLine, "style", "fill: #008100;")
+                        self.dirty = True
                 string = "clr: {m:02d}:{s:02d}".format(m=minutes, s=seconds)
                 self.setBackgroundColor("rgb({r},{g},{b})".format(r=calcValue, g=255, b=calcValue))
-            self.secondLine.string = string
+            if document.text(self.secondLine) != string:
+                document.setText(self.secondLine, string)
+                self.dirty = True
 
 
 def convertRegionName(name):
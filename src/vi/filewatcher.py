@@ -17,10 +17,18 @@
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import heapq
 import os
+import select
 import stat
+import struct
+import sys
 import time
 import logging
+import ctypes
+import ctypes.util
+
+import six
 
 from PyQt4 import QtCore
 from PyQt4.QtCore import SIGNAL
@@ -35,15 +43,25 @@ reread the files informations, trigger the QFileWatcher.
 So here is a workaround implementation.
 We use here also a QFileWatcher, only to the directory. It will notify it
 if a new file was created. We watch only the newest (last 24h), not all!
+
+How the changes are found is up to a backend: on Linux the kernel tells
+us about every write through inotify, everywhere else (or if inotify is
+not usable) we stat the files, the busy ones more often than the quiet.
 """
 
 DEFAULT_MAX_AGE = 60 * 60 * 24
+# Changes within this many seconds are emitted together as one batch
+DEFAULT_BATCH_WINDOW = 0.1
 
 class FileWatcher(QtCore.QThread):
-    def __init__(self, path, maxAge=DEFAULT_MAX_AGE):
+    def __init__(self, path, maxAge=DEFAULT_MAX_AGE, backend=None, batchWindow=DEFAULT_BATCH_WINDOW):
         QtCore.QThread.__init__(self)
         self.path = path
         self.maxAge = maxAge
+        self.batchWindow = batchWindow
+        self.pendingChanges = []
+        self.batchStart = 0
+        self.fileFilter = None
         self.files = {}
         self.updateWatchedFiles()
         self.qtfw = QtCore.QFileSystemWatcher()
@@ -51,6 +69,7 @@ class FileWatcher(QtCore.QThread):
         self.qtfw.addPath(path)
         self.paused = True
         self.active = True
+        self.backend = backend if backend else createBackend(self)
 
 
     def directoryChanged(self):
@@ -58,19 +77,47 @@ class FileWatcher(QtCore.QThread):
 
 
     def run(self):
-        while True:
-            time.sleep(0.5)
-            if not self.active:
-                return
-            if self.paused:
-                continue
-            for path, modified in self.files.items():
-                pathStat = os.stat(path)
-                if not stat.S_ISREG(pathStat.st_mode):
-                    continue
-                if modified < pathStat.st_size:
-                    self.emit(SIGNAL("file_change"), path)
-                self.files[path] = pathStat.st_size
+        self.backend.run()
+
+
+    def setFileFilter(self, fileFilter):
+        """ fileFilter is called with the path of every log and returns
+            if the log should be watched. None watches all logs.
+        """
+        self.fileFilter = fileFilter
+        self.updateWatchedFiles()
+
+
+    def isWatched(self, path):
+        return self.fileFilter is None or self.fileFilter(path)
+
+
+    def fileChanged(self, path):
+        """ Called by the backend for every changed file. The changes are
+            collected and emitted together by flushChanges
+        """
+        if not self.pendingChanges:
+            self.batchStart = time.time()
+        if path not in self.pendingChanges:
+            self.pendingChanges.append(path)
+
+
+    def secondsUntilFlush(self, maxWait):
+        """ How long the backend may sleep without delaying the next batch
+        """
+        if not self.pendingChanges:
+            return maxWait
+        return min(max(self.batchStart + self.batchWindow - time.time(), 0), maxWait)
+
+
+    def flushChanges(self):
+        """ Emits all collected changes as one list, if the first of them
+            is older than the batch window
+        """
+        if self.pendingChanges and time.time() >= self.batchStart + self.batchWindow:
+            paths = self.pendingChanges
+            self.pendingChanges = []
+            self.emit(SIGNAL("file_changes"), paths)
 
 
     def quit(self):
@@ -86,10 +133,190 @@ class FileWatcher(QtCore.QThread):
         filesInDir = {}
         for f in os.listdir(path):
             fullPath = os.path.join(path, f)
-            pathStat = os.stat(fullPath)
+            if not self.isWatched(fullPath):
+                continue
+            try:
+                pathStat = os.stat(fullPath)
+            except OSError:
+                # deleted since listdir
+                continue
             if not stat.S_ISREG(pathStat.st_mode):
                 continue
             if self.maxAge and ((now - pathStat.st_mtime) > self.maxAge):
                 continue
             filesInDir[fullPath] = self.files.get(fullPath, 0)
         self.files = filesInDir
+
+
+def createBackend(watcher):
+    """ Uses inotify where we can, polling everywhere else
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyBackend(watcher)
+        except Exception as e:
+            logging.warning("inotify not usable, falling back to polling: %s", e)
+    return PollingBackend(watcher)
+
+
+class PollingBackend(object):
+    """ Looks at the size of the watched files. A file that was just written
+        is looked at every FAST_INTERVAL seconds, each look without a change
+        doubles its interval. Files written in the last ACTIVE_PERIOD seconds
+        stay at WARM_INTERVAL at most, the others go up to SLOW_INTERVAL. So
+        the intel channels are checked often, the old logs nearly never.
+    """
+
+    FAST_INTERVAL = 0.1
+    WARM_INTERVAL = 0.5
+    SLOW_INTERVAL = 5.0
+    ACTIVE_PERIOD = 60 * 10
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+        self.schedule = []  # heap of (next check, path)
+        self.intervals = {}  # the current interval of every scheduled path
+        self.scheduledFiles = None  # the files-dict we have scheduled
+
+
+    def run(self):
+        watcher = self.watcher
+        while True:
+            if self.scheduledFiles is not watcher.files:
+                self._scheduleNewFiles()
+            wait = self.WARM_INTERVAL
+            if self.schedule:
+                wait = min(max(self.schedule[0][0] - time.time(), 0), wait)
+            time.sleep(watcher.secondsUntilFlush(wait))
+            if not watcher.active:
+                return
+            if watcher.paused:
+                continue
+            self._checkDueFiles()
+            watcher.flushChanges()
+
+
+    def _scheduleNewFiles(self):
+        files = self.watcher.files
+        now = time.time()
+        for path in files:
+            if path not in self.intervals:
+                self.intervals[path] = self.FAST_INTERVAL
+                heapq.heappush(self.schedule, (now, path))
+        self.scheduledFiles = files
+
+
+    def _checkDueFiles(self):
+        watcher = self.watcher
+        now = time.time()
+        while self.schedule and self.schedule[0][0] <= now:
+            path = heapq.heappop(self.schedule)[1]
+            if path not in watcher.files:
+                del self.intervals[path]
+                continue
+            try:
+                pathStat = os.stat(path)
+            except OSError:
+                del self.intervals[path]
+                continue
+            if stat.S_ISREG(pathStat.st_mode) and watcher.files[path] < pathStat.st_size:
+                watcher.fileChanged(path)
+                interval = self.FAST_INTERVAL
+            else:
+                maxInterval = self.WARM_INTERVAL if now - pathStat.st_mtime < self.ACTIVE_PERIOD else self.SLOW_INTERVAL
+                interval = min(self.intervals[path] * 2, maxInterval)
+            watcher.files[path] = pathStat.st_size
+            self.intervals[path] = interval
+            heapq.heappush(self.schedule, (now + interval, path))
+
+
+class InotifyBackend(object):
+    """ Lets the kernel tell us about every write into the chatlog directory,
+        so there is nothing to do as long as nobody writes
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, watcher):
+        """ Only tries if inotify is usable here, the descriptor is opened
+            by run, so nothing is left open if the thread never runs
+        """
+        self.watcher = watcher
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = None
+        os.close(self._open())
+
+
+    def _open(self):
+        """ Returns a new inotify descriptor watching the chatlog directory
+        """
+        fd = self.libc.inotify_init()
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        path = self.watcher.path
+        if isinstance(path, six.text_type):
+            path = path.encode(sys.getfilesystemencoding())
+        if self.libc.inotify_add_watch(fd, path, self.IN_MODIFY | self.IN_CREATE) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, "inotify_add_watch failed")
+        return fd
+
+
+    def run(self):
+        watcher = self.watcher
+        try:
+            self.fd = self._open()
+        except OSError as e:
+            logging.warning("inotify not usable, falling back to polling: %s", e)
+            PollingBackend(watcher).run()
+            return
+        changed = set()
+        try:
+            while watcher.active:
+                readable = select.select([self.fd], [], [], watcher.secondsUntilFlush(0.5))[0]
+                if readable:
+                    changed.update(self._readEvents())
+                # While paused we collect the changes and report them later
+                if watcher.paused or not watcher.active:
+                    continue
+                for path in sorted(changed):
+                    if watcher.isWatched(path):
+                        try:
+                            size = os.path.getsize(path)
+                        except OSError:
+                            # deleted since the event
+                            continue
+                        if os.path.isfile(path):
+                            watcher.files[path] = size
+                            watcher.fileChanged(path)
+                changed.clear()
+                watcher.flushChanges()
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+
+    def _readEvents(self):
+        """ Returns the paths of all files the kernel reported as created or
+            modified since the last call
+        """
+        paths = set()
+        data = os.read(self.fd, 64 * 1024)
+        pos = 0
+        while pos + self.EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, nameLength = self.EVENT_HEADER.unpack_from(data, pos)
+            pos += self.EVENT_HEADER.size
+            name = data[pos:pos + nameLength].rstrip(b"\0")
+            pos += nameLength
+            if mask & self.IN_Q_OVERFLOW:
+                # The kernel dropped events, so every file could have changed
+                paths.update(self.watcher.files.keys())
+            elif name:
+                if isinstance(self.watcher.path, six.text_type):
+                    name = name.decode(sys.getfilesystemencoding())
+                paths.add(os.path.join(self.watcher.path, name))
+        return paths
@@ -0,0 +1,418 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+""" The svg of a map, as tree of elements we can change and render again.
+    Map and System only work on the document through the methods here, so
+    the tree can be built by lxml (parsed in C, found by XPath) or, if lxml
+    is not installed, by BeautifulSoup. Elements are the elements of the
+    backend, only the document knows what to do with them.
+"""
+
+import re
+import six
+import logging
+
+from bs4 import BeautifulSoup
+from bs4 import element as soupElements
+from bs4.element import NavigableString, Tag
+
+global gLxmlAvailable
+
+try:
+    from lxml import etree
+
+    gLxmlAvailable = True
+except ImportError:
+    gLxmlAvailable = False
+
+
+def createDocument(svg):
+    """ The document of the svg, built by lxml if it is available
+    """
+    if gLxmlAvailable:
+        try:
+            return EtreeDocument(svg)
+        except etree.XMLSyntaxError as e:
+            logging.warning("The map is no valid xml, using BeautifulSoup: %s", e)
+    return SoupDocument(svg)
+
+
+def loadDocument(backend, content):
+    """ The document again from what dump of a document of the backend
+        returned, without parsing html
+    """
+    if backend == SoupDocument.BACKEND:
+        return SoupDocument(tree=content)
+    if backend == EtreeDocument.BACKEND and gLxmlAvailable:
+        return EtreeDocument(content)
+    raise ValueError("Can not load a document of {0}".format(backend))
+
+
+class MapDocument(object):
+    """ What both backends have in common
+    """
+
+    # a placeholder for fragment number n in the rendering, see renderParts
+    FRAGMENT_PATTERN = None
+    # the name of the backend for loadDocument
+    BACKEND = None
+
+    def __init__(self):
+        self._elementsById = {}
+
+    def _indexElement(self, element):
+        elementId = self.get(element, "id")
+        if elementId:
+            self._elementsById.setdefault(elementId, element)
+
+    def byId(self, elementId):
+        """ The (first) element with the id, None if there is none
+        """
+        return self._elementsById.get(elementId)
+
+    def state(self, element):
+        """ How the element looks: (tag name, attributes, text), the
+            attribute values as they are rendered
+        """
+        return self.name(element), self.attributes(element), self.text(element)
+
+    def renderParts(self, fragments):
+        """ Renders the document without the fragments, so they can be
+            rendered (renderFragment) into the gaps. A fragment is an
+            element or (parent, child) for the children of parent before
+            child. Returns a list in which static chunks and the numbers
+            of the fragments (as strings) take turns.
+        """
+        cutOut = [self._cutOut(fragment, number) for number, fragment in enumerate(fragments)]
+        content = self.render()
+        for fragment, (placeholder, children) in reversed(list(zip(fragments, cutOut))):
+            self._putBack(fragment, placeholder, children)
+        return re.split(self.FRAGMENT_PATTERN, content)
+
+    def renderFragment(self, fragment):
+        """ The rendering of a fragment (see renderParts)
+        """
+        if isinstance(fragment, tuple):
+            parent, child = fragment
+            return "".join(self._renderChild(element) for element in self._childrenBefore(parent, child))
+        return self.render(fragment)
+
+
+class SoupDocument(MapDocument):
+    """ The document as BeautifulSoup tree
+    """
+
+    FRAGMENT_PATTERN = "\x00fragment([0-9]+)\x00"
+    BACKEND = "soup"
+
+    def __init__(self, svg=None, tree=None):
+        """ From the svg, parsed by html.parser, or from a tree (see dump),
+            which needs no parsing
+        """
+        MapDocument.__init__(self)
+        if tree is None:
+            self.soup = BeautifulSoup(svg, 'html.parser')
+        else:
+            self.soup = BeautifulSoup("", 'html.parser')
+            for node in tree:
+                self._build(node)
+            self.soup.endData()
+        self.root = self.soup.find("svg")
+        for element in self.soup.find_all(id=True):
+            self._indexElement(element)
+
+    def dump(self):
+        """ The document as tree of lists, which can be stored as json: a tag
+            is [name, attributes, children], a string is text, or
+            [class, text] if it is a special string (f.e. CData)
+        """
+        return [self._dumpNode(node) for node in self.soup.contents]
+
+    def _dumpNode(self, node):
+        if isinstance(node, Tag):
+            return [node.name, self.attributes(node), [self._dumpNode(child) for child in node.contents]]
+        if type(node) is NavigableString:
+            return six.text_type(node)
+        return [type(node).__name__, six.text_type(node)]
+
+    def _build(self, node):
+        """ Builds the node, with the calls html.parser makes to the soup
+            when it finds the node in the svg
+        """
+        soup = self.soup
+        if isinstance(node, six.string_types):
+            soup.handle_data(node)
+        elif len(node) == 2:
+            stringClass = getattr(soupElements, node[0])
+            if not issubclass(stringClass, NavigableString):
+                raise ValueError("No string class: {0}".format(node[0]))
+            soup.endData()
+            soup.handle_data(node[1])
+            soup.endData(stringClass)
+        else:
+            name, attributes, children = node
+            soup.handle_starttag(name, None, None, attributes)
+            for child in children:
+                self._build(child)
+            soup.handle_endtag(name)
+
+    def findAll(self, parent, name):
+        return parent.find_all(name)
+
+    def withClass(self, parent, className):
+        return parent.find_all(class_=className)
+
+    def get(self, element, name, default=None):
+        return element.get(name, default)
+
+    def set(self, element, name, value):
+        element[name] = value
+        if name == "id":
+            self._indexElement(element)
+
+    def attributes(self, element):
+        attributes = {}
+        for name, value in element.attrs.items():
+            if isinstance(value, list):
+                value = u" ".join(value)
+            attributes[name] = six.text_type(value)
+        return attributes
+
+    def classes(self, element):
+        classes = element.get("class", [])
+        return classes if isinstance(classes, list) else classes.split()
+
+    def addClass(self, element, className):
+        classes = element.get("class")
+        if isinstance(classes, list):
+            classes.append(className)
+        else:
+            element["class"] = classes.split() + [className] if classes else [className]
+
+    def name(self, element):
+        return element.name
+
+    def text(self, element):
+        return element.string
+
+    def allText(self, element):
+        return element.text
+
+    def setText(self, element, text):
+        element.string = text
+
+    def parent(self, element):
+        return element.parent
+
+    def firstChild(self, parent):
+        return parent.contents[0] if parent.contents else None
+
+    def createElement(self, name, attributes):
+        element = self.soup.new_tag(name, **attributes)
+        self._indexElement(element)
+        return element
+
+    def insert(self, parent, index, element):
+        parent.insert(index, element)
+
+    def append(self, parent, element):
+        parent.append(element)
+
+    def remove(self, element):
+        elementId = element.get("id")
+        if self._elementsById.get(elementId) is element:
+            del self._elementsById[elementId]
+        element.decompose()
+
+    def render(self, element=None):
+        return str(self.soup if element is None else element)
+
+    def _renderChild(self, element):
+        return str(element)
+
+    def _childrenBefore(self, parent, child):
+        for element in parent.contents:
+            if element is child:
+                break
+            yield element
+
+    def _cutOut(self, fragment, number):
+        placeholder = NavigableString(u"\x00fragment{0}\x00".format(number))
+        if isinstance(fragment, tuple):
+            parent, child = fragment
+            children = [element.extract() for element in list(self._childrenBefore(parent, child))]
+            parent.insert(0, placeholder)
+            return placeholder, children
+        fragment.replace_with(placeholder)
+        return placeholder, None
+
+    def _putBack(self, fragment, placeholder, children):
+        if isinstance(fragment, tuple):
+            placeholder.extract()
+            for index, element in enumerate(children):
+                fragment[0].insert(index, element)
+        else:
+            placeholder.replace_with(fragment)
+
+
+class EtreeDocument(MapDocument):
+    """ The document as lxml tree
+    """
+
+    FRAGMENT_PATTERN = "<\\?fragment ([0-9]+)\\?>"
+    BACKEND = "etree"
+    # the namespace declarations lxml puts into the first tag of an
+    # element rendered alone, the document declared them already
+    NAMESPACE_DECLARATIONS = re.compile("^(<[^\\s/>]+)(?: xmlns(?::[\\w.-]+)?=\"[^\"]*\")+")
+    # native strings, as str() of a BeautifulSoup tree
+    ENCODING = "utf-8" if six.PY2 else "unicode"
+
+    def __init__(self, svg):
+        MapDocument.__init__(self)
+        if isinstance(svg, six.text_type):
+            svg = svg.encode("utf-8")
+        self.root = etree.fromstring(svg, etree.XMLParser(strip_cdata=False))
+        self.namespace = self.root.nsmap.get(None)
+        for element in self.root.iter(etree.Element):
+            self._indexElement(element)
+
+    def dump(self):
+        """ The document as xml, libxml2 reads it faster than we could build
+            it from anything else
+        """
+        return self.render()
+
+    def _tag(self, name):
+        return "{{{0}}}{1}".format(self.namespace, name) if self.namespace else name
+
+    def _attribute(self, name):
+        # xlink:href is {http://www.w3.org/1999/xlink}href in lxml
+        if ":" in name:
+            prefix, name = name.split(":", 1)
+            return "{{{0}}}{1}".format(self.root.nsmap[prefix], name)
+        return name
+
+    def findAll(self, parent, name):
+        return list(parent.iterdescendants(self._tag(name)))
+
+    def withClass(self, parent, className):
+        return parent.xpath(".//*[contains(concat(' ', normalize-space(@class), ' '), $className)]",
+                            className=u" {0} ".format(className))
+
+    def get(self, element, name, default=None):
+        return element.get(self._attribute(name), default)
+
+    def set(self, element, name, value):
+        element.set(self._attribute(name), six.text_type(value))
+        if name == "id":
+            self._indexElement(element)
+
+    def attributes(self, element):
+        return dict(element.attrib)
+
+    def classes(self, element):
+        return (element.get("class") or "").split()
+
+    def addClass(self, element, className):
+        element.set("class", " ".join(self.classes(element) + [className]))
+
+    def name(self, element):
+        return etree.QName(element).localname
+
+    def text(self, element):
+        # as BeautifulSoup's string: only the text of an element without children
+        return None if len(element) else element.text
+
+    def allText(self, element):
+        return u"".join(element.itertext())
+
+    def setText(self, element, text):
+        element.text = text
+
+    def parent(self, element):
+        return element.getparent()
+
+    def firstChild(self, parent):
+        return parent[0] if len(parent) else None
+
+    def createElement(self, name, attributes):
+        element = etree.Element(self._tag(name))
+        for attribute, value in attributes.items():
+            element.set(self._attribute(attribute), six.text_type(value))
+        self._indexElement(element)
+        return element
+
+    def insert(self, parent, index, element):
+        parent.insert(index, element)
+
+    def append(self, parent, element):
+        parent.append(element)
+
+    def remove(self, element):
+        elementId = element.get("id")
+        if self._elementsById.get(elementId) is element:
+            del self._elementsById[elementId]
+        # the text after the element belongs to it in lxml
+        if element.tail:
+            previous = element.getprevious()
+            parent = element.getparent()
+            if previous is not None:
+                previous.tail = (previous.tail or "") + element.tail
+            else:
+                parent.text = (parent.text or "") + element.tail
+        element.getparent().remove(element)
+
+    def render(self, element=None):
+        if element is None:
+            return etree.tostring(self.root.getroottree(), encoding=self.ENCODING)
+        content = etree.tostring(element, encoding=self.ENCODING, with_tail=False)
+        return self.NAMESPACE_DECLARATIONS.sub("\\1", content, 1)
+
+    def _renderChild(self, element):
+        content = etree.tostring(element, encoding=self.ENCODING, with_tail=True)
+        return self.NAMESPACE_DECLARATIONS.sub("\\1", content, 1)
+
+    def _childrenBefore(self, parent, child):
+        for element in parent:
+            if element is child:
+                break
+            yield element
+
+    def _cutOut(self, fragment, number):
+        placeholder = etree.ProcessingInstruction("fragment", str(number))
+        if isinstance(fragment, tuple):
+            parent, child = fragment
+            children = list(self._childrenBefore(parent, child))
+            for element in children:
+                parent.remove(element)
+            parent.insert(0, placeholder)
+            return placeholder, children
+        placeholder.tail = fragment.tail
+        fragment.getparent().replace(fragment, placeholder)
+        return placeholder, None
+
+    def _putBack(self, fragment, placeholder, children):
+        if isinstance(fragment, tuple):
+            parent = fragment[0]
+            parent.remove(placeholder)
+            for index, element in enumerate(children):
+                parent.insert(index, element)
+        else:
+            placeholder.getparent().replace(placeholder, fragment)
@@ -19,6 +19,7 @@
 
 import time
 import logging
+import threading
 import six
 
 from six.moves import queue
@@ -149,6 +150,125 @@ class KOSCheckerThread(QThread):
         QThread.quit(self)
 
 
+class ChatParserThread(QThread):
+    """ Parses the changed logs, so the GUI thread only gets the messages,
+        as MessageRecords. The GUI asks for the other work on the parser
+        (checkpoints, rooms) with a task, so it never waits for a parse.
+        Everybody else using the chatparser must hold the lock.
+    """
+
+    def __init__(self):
+        QThread.__init__(self)
+        self.queue = queue.Queue()
+        self.lock = threading.RLock()
+        self.chatparser = None
+        self.active = True
+
+
+    def setChatParser(self, chatparser):
+        """ The new parser takes over the logs of the one it replaces
+        """
+        with self.lock:
+            # a QMessageBox can only be shown by the GUI thread
+            chatparser.warningHandler = self.warning
+            if self.chatparser is not None:
+                chatparser.takeOverFiles(self.chatparser)
+            self.chatparser = chatparser
+
+
+    def warning(self, title, text):
+        self.emit(SIGNAL("warning"), title, text)
+
+
+    def addChanges(self, paths):
+        """ Called (by the file watcher) with a list of changed logs
+        """
+        self.queue.put(("changes", paths))
+
+
+    def saveCheckpoints(self):
+        """ The checkpoints are saved after the current batch
+        """
+        self.queue.put(("checkpoints",))
+
+
+    def setRooms(self, rooms):
+        """ Changes the rooms of the parser after the current batch, emits
+            rooms_set when they are changed
+        """
+        self.queue.put(("rooms", rooms))
+
+
+    def run(self):
+        while True:
+            # Block waiting for something to do
+            items = [self.queue.get()]
+            # the changes that came while we parsed the last ones are one batch
+            try:
+                while True:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            paths = []
+            tasks = []
+            for item in items:
+                if item is None:
+                    self.active = False
+                elif item[0] == "changes":
+                    paths.extend(path for path in item[1] if path not in paths)
+                else:
+                    tasks.append(item)
+            if not self.active:
+                # the last lines will be read at the next start
+                self._saveCheckpoints()
+                return
+            if paths:
+                self._parse(paths)
+            for task in tasks:
+                if task[0] == "checkpoints":
+                    self._saveCheckpoints()
+                elif task[0] == "rooms":
+                    with self.lock:
+                        if self.chatparser is not None:
+                            self.chatparser.setRooms(task[1])
+                    self.emit(SIGNAL("rooms_set"))
+
+
+    def _parse(self, paths):
+        try:
+            messages = []
+            with self.lock:
+                chatparser = self.chatparser
+                if chatparser is None:
+                    return
+                for path in paths:
+                    messages.extend(chatparser.fileModified(path))
+                # the parser keeps its messages to correlate later lines
+                records = tuple(message.record() for message in messages)
+            if records:
+                self.emit(SIGNAL("messages_parsed"), records)
+        except Exception as e:
+            logging.error("Error in ChatParserThread: %s", e)
+
+
+    def _saveCheckpoints(self):
+        with self.lock:
+            if self.chatparser is None:
+                return
+            try:
+                self.chatparser.saveCheckpoints()
+            except Exception as e:
+                logging.error("Saving the chatlog checkpoints failed: %s", e)
+            parsedLines = self.chatparser.parsedLines
+            logging.debug("Parsed lines cache: %d hits, %d misses", parsedLines.hits, parsedLines.misses)
+
+
+    def quit(self):
+        self.active = False
+        self.queue.put(None)
+        QThread.quit(self)
+
+
 class MapStatisticsThread(QThread):
 
     def __init__(self):
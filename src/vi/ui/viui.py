@@ -17,6 +17,7 @@
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import calendar
 import datetime
 import sys
 import time
@@ -38,16 +39,17 @@ from vi import states
 from vi.cache.cache import Cache
 from vi.resources import resourcePath
 from vi.soundmanager import SoundManager
-from vi.threads import AvatarFindThread, KOSCheckerThread, MapStatisticsThread
+from vi.threads import AvatarFindThread, ChatParserThread, KOSCheckerThread, MapStatisticsThread
 from vi.ui.systemtray import TrayContextMenu
-from vi.chatparser import ChatParser
+from vi.chatparser import ChatParser, backfill
+from vi.chatparser.chatparser import CLEAR_CORRELATION_SECS, MESSAGE_EXPIRY_SECS, Message
 from PyQt4.QtGui import QAction
 from PyQt4.QtGui import QMessageBox
 
 # Timer intervals
-MESSAGE_EXPIRY_SECS = 20 * 60
 MAP_UPDATE_INTERVAL_MSECS = 4 * 1000
 CLIPBOARD_CHECK_INTERVAL_MSECS = 4 * 1000
+CHECKPOINT_INTERVAL_MSECS = 60 * 1000
 
 
 class MainWindow(QtGui.QMainWindow):
@@ -70,6 +72,8 @@ class MainWindow(QtGui.QMainWindow):
         self.pathToLogs = pathToLogs
         self.mapTimer = QtCore.QTimer(self)
         self.connect(self.mapTimer, SIGNAL("timeout()"), self.updateMapView)
+        self.checkpointTimer = QtCore.QTimer(self)
+        self.connect(self.checkpointTimer, SIGNAL("timeout()"), self.saveCheckpoints)
         self.clipboardTimer = QtCore.QTimer(self)
         self.oldClipboardContent = ""
         self.trayIcon = trayIcon
@@ -135,6 +139,7 @@ class MainWindow(QtGui.QMainWindow):
         self.recallCachedSettings()
         self.setupThreads()
         self.setupMap(True)
+        self.checkpointTimer.start(CHECKPOINT_INTERVAL_MSECS)
 
 
     def paintEvent(self, event):
@@ -168,6 +173,7 @@ class MainWindow(QtGui.QMainWindow):
         self.connect(self.showChatAvatarsAction, SIGNAL("triggered()"), self.changeShowAvatars)
         self.connect(self.alwaysOnTopAction, SIGNAL("triggered()"), self.changeAlwaysOnTop)
         self.connect(self.chooseChatRoomsAction, SIGNAL("triggered()"), self.showChatroomChooser)
+        self.connect(self.chatTimingAction, SIGNAL("triggered()"), self.showChatTimingChooser)
         self.connect(self.catchRegionAction, SIGNAL("triggered()"), lambda : self.handleRegionMenuItemSelected(self.catchRegionAction))
         self.connect(self.providenceRegionAction, SIGNAL("triggered()"), lambda : self.handleRegionMenuItemSelected(self.providenceRegionAction))
         self.connect(self.queriousRegionAction, SIGNAL("triggered()"), lambda : self.handleRegionMenuItemSelected(self.queriousRegionAction))
@@ -198,8 +204,18 @@ class MainWindow(QtGui.QMainWindow):
         self.connect(self.kosRequestThread, SIGNAL("kos_result"), self.showKosResult)
         self.kosRequestThread.start()
 
-        self.filewatcherThread = filewatcher.FileWatcher(self.pathToLogs)
-        self.connect(self.filewatcherThread, SIGNAL("file_change"), self.logFileChanged)
+        batchWindow = self.cache.getFromCache("filewatcher_batch_window_msecs")
+        batchWindow = float(batchWindow) / 1000 if batchWindow else filewatcher.DEFAULT_BATCH_WINDOW
+        self.chatParserThread = ChatParserThread()
+        self.connect(self.chatParserThread, SIGNAL("messages_parsed"), self.messagesParsed)
+        self.connect(self.chatParserThread, SIGNAL("warning"), self.showWarning)
+        self.chatParserThread.start()
+
+        self.filewatcherThread = filewatcher.FileWatcher(self.pathToLogs, batchWindow=batchWindow)
+        # the changes go straight to the chat parser thread, not through the GUI thread
+        self.connect(self.filewatcherThread, SIGNAL("file_changes"), self.chatParserThread.addChanges,
+                     QtCore.Qt.DirectConnection)
+        self.connect(self.chatParserThread, SIGNAL("rooms_set"), self.filewatcherThread.updateWatchedFiles)
         self.filewatcherThread.start()
 
         self.versionCheckThread = amazon_s3.NotifyNewVersionThread()
@@ -247,7 +263,14 @@ class MainWindow(QtGui.QMainWindow):
         self.setJumpbridges(self.cache.getFromCache("jumpbridge_url"))
         self.systems = self.dotlan.systems
         logging.critical("Creating chat parser")
-        self.chatparser = ChatParser(self.pathToLogs, self.roomnames, self.systems)
+        self.chatparser = ChatParser(self.pathToLogs, self.roomnames, self.systems, self.dotlan.systemNameIndex)
+        clearCorrelationSecs = self.cache.getFromCache("clear_correlation_secs")
+        if clearCorrelationSecs:
+            self.chatparser.clearCorrelationSecs = float(clearCorrelationSecs)
+        self.filewatcherThread.setFileFilter(self.chatparser.isWatchedFile)
+        self.chatParserThread.setChatParser(self.chatparser)
+        # the chat has the intel already after a change of the region
+        self.backfillIntel(addToChat=initialize)
 
         # Menus - only once
         if initialize:
@@ -351,6 +374,8 @@ class MainWindow(QtGui.QMainWindow):
             self.avatarFindThread.wait()
             self.filewatcherThread.quit()
             self.filewatcherThread.wait()
+            self.chatParserThread.quit()
+            self.chatParserThread.wait()
             self.kosRequestThread.quit()
             self.kosRequestThread.wait()
             self.versionCheckThread.quit()
@@ -363,6 +388,16 @@ class MainWindow(QtGui.QMainWindow):
         event.accept()
 
 
+    def saveCheckpoints(self):
+        # saved by the chat parser thread between two batches (and when it
+        # stops), so we never wait for a parse here
+        self.chatParserThread.saveCheckpoints()
+
+
+    def showWarning(self, title, text):
+        QMessageBox.warning(None, title, text, "OK")
+
+
     def notifyNewerVersion(self, newestVersion):
         self.trayIcon.showMessage("Newer Version", ("An update is available for Vintel.\nhttps://github.com/Xanthos-Eve/vintel"), 1)
 
@@ -530,12 +565,15 @@ class MainWindow(QtGui.QMainWindow):
         self.updateMapView()
 
 
-    def setLocation(self, char, newSystem):
+    def setLocation(self, char, newSystem, updateMap=True):
         for system in self.systems.values():
             system.removeLocatedCharacter(char)
         if not newSystem == "?" and newSystem in self.systems:
             self.systems[newSystem].addLocatedCharacter(char)
-            self.setMapContent(self.dotlan.svg)
+            if updateMap:
+                self.updateMapView()
+            return True
+        return False
 
 
     def setMapContent(self, content):
@@ -582,6 +620,21 @@ class MainWindow(QtGui.QMainWindow):
         chooser.show()
 
 
+    def showChatTimingChooser(self):
+        chooser = ChatTimingChooser(self)
+        chooser.connect(chooser, SIGNAL("timing_changed"), self.changedChatTiming)
+        chooser.show()
+
+
+    def changedChatTiming(self):
+        batchWindow = self.cache.getFromCache("filewatcher_batch_window_msecs")
+        self.filewatcherThread.batchWindow = float(batchWindow) / 1000 if batchWindow else filewatcher.DEFAULT_BATCH_WINDOW
+        clearCorrelationSecs = self.cache.getFromCache("clear_correlation_secs")
+        # a number is set at once, we need not to wait for the parser thread
+        self.chatparser.clearCorrelationSecs = float(clearCorrelationSecs) if clearCorrelationSecs \
+            else CLEAR_CORRELATION_SECS
+
+
     def showJumbridgeChooser(self):
         url = self.cache.getFromCache("jumpbridge_url")
         chooser = JumpbridgeChooser(self, url)
@@ -702,7 +755,9 @@ class MainWindow(QtGui.QMainWindow):
 
     def changedRoomnames(self, newRoomnames):
         self.cache.putIntoCache("room_names", u",".join(newRoomnames), 60 * 60 * 24 * 365 * 5)
-        self.chatparser.rooms = newRoomnames
+        self.roomnames = newRoomnames
+        # the file watcher follows, when the thread emits rooms_set
+        self.chatParserThread.setRooms(newRoomnames)
 
 
     def showInfo(self):
@@ -756,7 +811,13 @@ class MainWindow(QtGui.QMainWindow):
 
     def updateMapView(self):
         logging.debug("Updating map start")
-        self.setMapContent(self.dotlan.svg)
+        # the loaded map is only patched, a full reload is needed after a
+        # change of the region or the jumpbridges
+        script = self.dotlan.changesScript()
+        if script is None:
+            self.setMapContent(self.dotlan.svg)
+        elif script:
+            self.mapView.page().mainFrame().evaluateJavaScript(script)
         logging.debug("Updating map complete")
 
 
@@ -768,32 +829,74 @@ class MainWindow(QtGui.QMainWindow):
         self.mapView.setZoomFactor(self.mapView.zoomFactor() - 0.1)
 
 
-    def logFileChanged(self, path):
-        messages = self.chatparser.fileModified(path)
-        for message in messages:
+    def backfillIntel(self, addToChat=True):
+        """ Puts the intel of the last minutes from the logs and the known
+            locations of the chars on the map and (if addToChat) the intel
+            into the chat, without any alarms
+        """
+        with self.chatParserThread.lock:
+            try:
+                records = [message.record() for message in backfill.backfill(self.chatparser)]
+            except Exception as e:
+                logging.error("Backfill of the intel failed: %s", e)
+                records = []
+            locations = [(charname, location["system"]) for charname, location in self.chatparser.locations.items()]
+        for record in records:
+            message = self.messageOfRecord(record)
+            if addToChat:
+                self.addMessageToIntelChat(message)
+            alarmTime = calendar.timegm(message.timestamp.timetuple())
+            for system in message.systems:
+                # a batch of the replaced parser may have brought it already
+                if message not in system.messages:
+                    system.messages.append(message)
+                system.setStatus(message.status, alarmTime)
+        for charname, systemname in locations:
+            self.setLocation(charname, systemname, updateMap=False)
+
+    def messageOfRecord(self, record):
+        """ The Message of the GUI for a MessageRecord of the chat parser,
+            with the systems of the current map (a record parsed before a
+            change of the region may name systems we do not have)
+        """
+        systems = [self.systems[name] for name in record.systems if name in self.systems]
+        return Message(record.room, record.message, record.timestamp, record.user, systems, record.upperText,
+                       record.plainText, record.status)
+
+    def messagesParsed(self, records):
+        """ The MessageRecords the chat parser thread found in one batch of
+            changed logs. Only their changes are applied here, the map is
+            rendered once afterwards
+        """
+        start = time.time()
+        mapChanged = False
+        for record in records:
             # If players location has changed
-            if message.status == states.LOCATION:
-                self.knownPlayerNames.add(message.user)
-                self.setLocation(message.user, message.systems[0])
-            elif message.status == states.KOS_STATUS_REQUEST:
-                # Do not accept KOS requests from any but monitored intel channels
-                # as we don't want to encourage the use of xxx in those channels.
-                if not message.room in self.roomnames:
-                    text = message.message[4:]
+            if record.status == states.LOCATION:
+                self.knownPlayerNames.add(record.user)
+                if self.setLocation(record.user, record.systems[0], updateMap=False):
+                    mapChanged = True
+            elif record.status == states.KOS_STATUS_REQUEST:
+                # Only the logs of the intel channels, Local and the kos
+                # channels (starting with =) are read, so the requests come
+                # from the intel or the kos channels
+                if record.room in self.roomnames or record.room.startswith("="):
+                    text = record.message[4:]
                     text = text.replace("  ", ",")
                     parts = (name.strip() for name in text.split(","))
                     self.trayIcon.setIcon(self.taskbarIconWorking)
                     self.kosRequestThread.addRequest(parts, "xxx", False)
             # Otherwise consider it a 'normal' chat message
-            elif message.user not in ("EVE-System", "EVE System") and message.status != states.IGNORE:
+            elif record.user not in ("EVE-System", "EVE System") and record.status != states.IGNORE:
+                message = self.messageOfRecord(record)
                 self.addMessageToIntelChat(message)
                 # For each system that was mentioned in the message, check for alarm distance to the current system
                 # and alarm if within alarm distance.
-                systemList = self.dotlan.systems
                 if message.systems:
                     for system in message.systems:
-                        systemname = system.name
-                        systemList[systemname].setStatus(message.status)
+                        if message not in system.messages:
+                            system.messages.append(message)
+                        system.setStatus(message.status)
                         if message.status in (states.REQUEST, states.ALARM) and message.user not in self.knownPlayerNames:
                             alarmDistance = self.alarmDistance if message.status == states.ALARM else 0
                             for nSystem, data in system.getNeighbours(alarmDistance).items():
@@ -801,7 +904,10 @@ class MainWindow(QtGui.QMainWindow):
                                 chars = nSystem.getLocatedCharacters()
                                 if len(chars) > 0 and message.user not in chars:
                                     self.trayIcon.showNotification(message, system.name, ", ".join(chars), distance)
-                self.setMapContent(self.dotlan.svg)
+                mapChanged = True
+        if mapChanged:
+            self.updateMapView()
+        logging.debug("Applied %d messages in %.1f ms", len(records), (time.time() - start) * 1000)
 
 
 class ChatroomsChooser(QtGui.QDialog):
@@ -829,6 +935,38 @@ class ChatroomsChooser(QtGui.QDialog):
         self.roomnamesField.setPlainText(u"TheCitadel,North Provi Intel,North Catch Intel,North Querious Intel")
 
 
+class ChatTimingChooser(QtGui.QDialog):
+    def __init__(self, parent):
+        QtGui.QDialog.__init__(self, parent)
+        uic.loadUi(resourcePath("vi/ui/ChatTiming.ui"), self)
+        self.connect(self.defaultButton, SIGNAL("clicked()"), self.setDefaults)
+        self.connect(self.cancelButton, SIGNAL("clicked()"), self.accept)
+        self.connect(self.saveButton, SIGNAL("clicked()"), self.saveClicked)
+        cache = Cache()
+        batchWindow = cache.getFromCache("filewatcher_batch_window_msecs")
+        clearCorrelationSecs = cache.getFromCache("clear_correlation_secs")
+        self.setDefaults()
+        if batchWindow:
+            self.batchWindowField.setValue(int(float(batchWindow)))
+        if clearCorrelationSecs:
+            self.clearCorrelationField.setValue(int(float(clearCorrelationSecs)))
+
+
+    def saveClicked(self):
+        cache = Cache()
+        cache.putIntoCache("filewatcher_batch_window_msecs", six.text_type(self.batchWindowField.value()),
+                           60 * 60 * 24 * 365 * 5)
+        cache.putIntoCache("clear_correlation_secs", six.text_type(self.clearCorrelationField.value()),
+                           60 * 60 * 24 * 365 * 5)
+        self.accept()
+        self.emit(SIGNAL("timing_changed"))
+
+
+    def setDefaults(self):
+        self.batchWindowField.setValue(int(filewatcher.DEFAULT_BATCH_WINDOW * 1000))
+        self.clearCorrelationField.setValue(CLEAR_CORRELATION_SECS)
+
+
 class RegionChooser(QtGui.QDialog):
     def __init__(self, parent):
         QtGui.QDialog.__init__(self, parent)
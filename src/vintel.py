@@ -21,6 +21,7 @@
 import sys
 import os
 import logging
+import multiprocessing
 import traceback
 
 from logging.handlers import RotatingFileHandler
@@ -134,6 +135,8 @@ class Application(QApplication):
 
 # The main application
 if __name__ == "__main__":
+    # the backfill of the chat parser runs in processes, also in the frozen exe
+    multiprocessing.freeze_support()
 
     app = Application(sys.argv)
     sys.exit(app.exec_())
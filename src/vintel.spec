@@ -23,6 +23,7 @@ a.datas += [('vi/ui/MainWindow.ui', 'vi/ui/MainWindow.ui', 'DATA'),
             ('vi/ui/ChatEntry.ui', 'vi/ui/ChatEntry.ui', 'DATA'),
             ('vi/ui/Info.ui', 'vi/ui/Info.ui', 'DATA'),
             ('vi/ui/ChatroomsChooser.ui', 'vi/ui/ChatroomsChooser.ui', 'DATA'),
+            ('vi/ui/ChatTiming.ui', 'vi/ui/ChatTiming.ui', 'DATA'),
             ('vi/ui/RegionChooser.ui', 'vi/ui/RegionChooser.ui', 'DATA'),
             ('vi/ui/SoundSetup.ui', 'vi/ui/SoundSetup.ui', 'DATA'),
             ('vi/ui/JumpbridgeChooser.ui', 'vi/ui/JumpbridgeChooser.ui', 'DATA'),